@@ -1,44 +1,112 @@
-"""S3 managemnent functions.
-Let's see how we refactor this to transparently use config from file or api server."""
+"""S3 management functions.
+Let's see how we refactor this to transparently use config from file or api server.
+
+Clients are cached per endpoint and credentials, boto3 clients are thread safe so all helpers share one.
+The url and the plugin's credentials are read from the config once per process, the credentials are re-read when S3 rejects them.
+"""
 import os
 import datetime as dt
+import hashlib
+import threading
 from pathlib import Path
-from typing import Union
+from typing import Any, Callable, Optional, Union
 from freeds_setup.importing.plugin_config import PluginConfig
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
-def get_s3_client(user:str=None, password:str = None) -> boto3.client:
-    """Get an S3 client using config from the config api"""
-    if not user and password or not password and user:
-        raise ValueError('User and password must either both be provided or neither.')
-    url = os.environ.get('FDS_SHARED_S3_URL')
+# error codes meaning the credentials are wrong or outdated, head requests only give the http status
+AUTH_ERROR_CODES = ("InvalidAccessKeyId", "SignatureDoesNotMatch", "ExpiredToken", "InvalidToken", "403")
+
+_client_config = Config(max_pool_connections=10, retries={"max_attempts": 3, "mode": "standard"})
+_clients: dict[tuple[str, str, str], Any] = {}
+_url: Optional[str] = None
+_credentials: Optional[tuple[str, str]] = None
+_lock = threading.Lock()
 
-    if not url:
-        plugin_config = PluginConfig('shared')
-        url = plugin_config.config.get('s3_url')
 
+def _resolve_url() -> str:
+    """Return the S3 url from FDS_SHARED_S3_URL or the shared plugin config, the config is read once per process."""
+    global _url
+    url = os.environ.get('FDS_SHARED_S3_URL')
+    if url:
+        return url
+    with _lock:
+        if _url:
+            return _url
+    url = PluginConfig('shared').config.get('s3_url')
+    with _lock:
+        _url = url
+    return url
+
+
+def _resolve_credentials(refresh: bool = False) -> tuple[str, str]:
+    """Return the current plugin's S3 user and password, read once per process unless refresh is set."""
+    global _credentials
+    with _lock:
+        if _credentials and not refresh:
+            return _credentials
+
+    # get user and password from vault
+    plugin_config = PluginConfig()
+    user = plugin_config.config.get('s3_user')
+    password = plugin_config.config.get('s3_password')
+    if not user or not password:
+        raise ValueError(f'S3 credentials not found for plugin {plugin_config.name}')
+    with _lock:
+        _credentials = (user, password)
+    return _credentials
+
+
+def get_s3_client(user:str=None, password:str = None, refresh: bool = False) -> boto3.client:
+    """Get an S3 client using config from the config api, the client is created once and reused.
+    Without user and password the current plugin's credentials are used, refresh re-reads them and creates a new client."""
+    if not user and password or not password and user:
+        raise ValueError('User and password must either both be provided or neither.')
+    url = _resolve_url()
     if not user:
-        # get user and password from vault
-        plugin_config = PluginConfig()
-        user = plugin_config.config.get('s3_user')
-        password = plugin_config.config.get('s3_password')
-        if not user or not password:
-            raise ValueError(f'S3 credentials not found for plugin {plugin_config.name}')
-
-    s3_client = boto3.client(
-        service_name="s3",
-        aws_access_key_id=user,
-        aws_secret_access_key=password,
-        endpoint_url=,
-    )
+        user, password = _resolve_credentials(refresh=refresh)
+
+    # the password isn't kept in the key, only a hash of it
+    key = (url, user, hashlib.sha256(password.encode()).hexdigest())
+    with _lock:
+        s3_client = None if refresh else _clients.get(key)
+        if s3_client is None:
+            # a session per client, the default boto3 session isn't thread safe
+            s3_client = boto3.session.Session().client(
+                service_name="s3",
+                aws_access_key_id=user,
+                aws_secret_access_key=password,
+                endpoint_url=url,
+                config=_client_config,
+            )
+            _clients[key] = s3_client
     return s3_client
 
 
+def reset_s3_clients() -> None:
+    """Forget the cached clients, url and credentials, the next call reads the config again."""
+    global _url, _credentials
+    with _lock:
+        _clients.clear()
+        _url = None
+        _credentials = None
+
+
+def _with_client(call: Callable[[Any], Any]) -> Any:
+    """Run call with the shared client, if S3 rejects the credentials they are read again and call is retried once."""
+    try:
+        return call(get_s3_client())
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in AUTH_ERROR_CODES:
+            raise
+    return call(get_s3_client(refresh=True))
+
+
 def is_s3_service_available() -> bool:
     """Simple check if s3 works. A negative response might indicate service down or invalid credentials."""
     try:
-        get_s3_client().list_buckets()
+        _with_client(lambda s3: s3.list_buckets())
         return True
     except Exception:
         print(
@@ -49,7 +117,7 @@ def is_s3_service_available() -> bool:
 
 def bucket_exists(bucket_name: str) -> bool:
     """Check if an S3 bucket exists."""
-    response = get_s3_client().list_buckets()
+    response = _with_client(lambda s3: s3.list_buckets())
     for bucket in response.get("Buckets", []):
         if bucket["Name"] == bucket_name:
             return True
@@ -61,7 +129,7 @@ def file_exists(bucket_name: str, file_name: str, prefix: Union[str, None] = Non
     """Check if a file exists on S3."""
     try:
         key = f"{prefix}/{file_name}" if prefix else file_name
-        get_s3_client().head_object(Bucket=bucket_name, Key=key)
+        _with_client(lambda s3: s3.head_object(Bucket=bucket_name, Key=key))
         return True
     except ClientError as e:
         if e.response["Error"]["Code"] == "404":
@@ -78,8 +146,7 @@ def create_bucket(bucket_name: str) -> bool:
         if bucket_exists(bucket_name):
             print(f"S3 bucket {bucket_name} already exists.")
             return True
-        s3_client = get_s3_client()
-        s3_client.create_bucket(Bucket=bucket_name)
+        _with_client(lambda s3: s3.create_bucket(Bucket=bucket_name))
         print(f"Bucket {bucket_name} created.")
         return True
     except ClientError as e:
@@ -91,24 +158,25 @@ def delete_bucket(bucket_name: str) -> None:
     """Delete S3 bucket if it exists."""
     if not bucket_exists(bucket_name):
         return
-    s3_client = get_s3_client()
-    s3_client.delete_bucket(Bucket=bucket_name)
+    _with_client(lambda s3: s3.delete_bucket(Bucket=bucket_name))
 
 
 def delete_prefix(bucket: str, prefix: str) -> None:
     """Delete all files with a given prefix in a bucket."""
-    s3 = get_s3_client()
-    paginator = s3.get_paginator("list_objects_v2")
-    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
-        if "Contents" in page:
-            objects = [{"Key": obj["Key"]} for obj in page["Contents"]]
-            s3.delete_objects(Bucket=bucket, Delete={"Objects": objects})
+
+    def delete(s3) -> None:
+        paginator = s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            if "Contents" in page:
+                objects = [{"Key": obj["Key"]} for obj in page["Contents"]]
+                s3.delete_objects(Bucket=bucket, Delete={"Objects": objects})
+
+    _with_client(delete)
 
 
 def put_file(local_path: Union[str, Path], bucket: str, file_name: str, prefix: Union[str, None] = None) -> bool:
     """Upload a file to S3."""
 
-    s3_client = get_s3_client()
     if prefix and not prefix.endswith("/"):
         prefix = prefix + "/"
     s3_key = prefix + file_name if prefix else file_name
@@ -116,7 +184,7 @@ def put_file(local_path: Union[str, Path], bucket: str, file_name: str, prefix:
     try:
         text = f"{local_path} to bucket '{bucket}' as '{s3_key}'"
         print(f"Intitating upload: {text}.")
-        s3_client.upload_file(local_path, bucket, s3_key)
+        _with_client(lambda s3: s3.upload_file(local_path, bucket, s3_key))
         print(f"Upload succeeded: {text}.")
         return True
     except Exception as e:
@@ -130,8 +198,7 @@ def get_file(local_path: Union[str, Path], bucket: str, file_name: str, prefix:
     text = f"{source_object_name} to {local_path}"
     print(f"Intitating download: {text}.")
     try:
-        s3_client = get_s3_client()
-        s3_client.download_file(bucket, source_object_name, local_path)
+        _with_client(lambda s3: s3.download_file(bucket, source_object_name, local_path))
         print(f"Download completed: {text}.")
         return True
     except ClientError as e:
@@ -153,14 +220,16 @@ def as_urls(files: list[str], bucket_name: str) -> list[str]:
 
 def list_files(prefix: str, bucket_name: str) -> list[str]:
     """Expand s3 path and return all files under the given prefix, prefix should not contain any part of the filename or wildcards."""
-    s3 = get_s3_client()
-    paginator = s3.get_paginator("list_objects_v2")
-    pages = paginator.paginate(Bucket=bucket_name, Prefix=prefix)
-    all_files = []
-    for page in pages:
-        for obj in page.get("Contents", []):
-            all_files.append(obj["Key"])
-    return all_files
+
+    def list_keys(s3) -> list[str]:
+        paginator = s3.get_paginator("list_objects_v2")
+        all_files = []
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                all_files.append(obj["Key"])
+        return all_files
+
+    return _with_client(list_keys)
 
 
 def list_files_for_dates(dates: list[Union[dt.datetime, dt.date]], root_prefix: str, bucket_name: str) -> list[str]:
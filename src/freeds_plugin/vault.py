@@ -1,4 +1,4 @@
-from freeds_setup.helpers.bao_client import BaoClient
+from freeds_setup.helpers.bao_client import get_bao_client
 
 
 class VaultUtil:
@@ -6,7 +6,7 @@ class VaultUtil:
 
     def __init__(self, plugin_name: str):
         self.plugin_name = plugin_name
-        self.bao = BaoClient()
+        self.bao = get_bao_client()
 
 
 if __name__ == "__main__":
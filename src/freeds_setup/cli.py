@@ -1,8 +1,17 @@
+import json
 import typer
 from pathlib import Path
 from freeds_setup.commands.init_cmd import init_app
 from freeds_setup.commands.pwd import pwd_app
+from freeds_setup.commands.snapshot_cmd import snapshot_app
+from freeds_setup.helpers import compose_merge, stack
+from freeds_setup.helpers import status as stack_status
 from freeds_setup.helpers.root_config import root_config
+from freeds_setup.importing.plugin_config import PluginConfig, prefetch
+import freeds_setup.importing.plugin_import as plugin_import
+import freeds_setup.importing.plugin_watcher as plugin_watcher
+from freeds_setup.importing.plugin_scanner import DEFAULT_MAX_DEPTH
+from freeds_setup.importing.resource_plan import NOOP
 
 
 app = typer.Typer(help="Freeds Setup CLI")
@@ -10,33 +19,175 @@ root_config.set_env()
 
 app.add_typer(init_app, name="init")
 app.add_typer(pwd_app, name="pwd")
+app.add_typer(snapshot_app, name="snapshot")
 
 
 @app.command("scan")
 def scan(
-    folder: Path = typer.Argument(".", help="Optional folder name to scan"),
+    folder: Path = typer.Argument(None, help="Folder to scan, default is the plugins folder"),
     import_flag: bool = typer.Option(
-        False, "--import", "-i", help="Import flag to enable importing"
+        False, "--import", "-i", help="Import the plugins found"
     ),
+    ignore: list[str] = typer.Option(
+        None, "--ignore", help="Folder name pattern to skip, added to the defaults, can be repeated"
+    ),
+    max_depth: int = typer.Option(DEFAULT_MAX_DEPTH, "--max-depth", help="Max folder depth below the scanned folder"),
+    max_parallel: int = typer.Option(4, "--max-parallel", help="Max number of plugins imported at once"),
+    watch: bool = typer.Option(
+        False, "--watch", "-w", help="Keep running and re-import plugins when their plugin.yaml or compose file changes"
+    ),
+    debounce: float = typer.Option(0.2, "--debounce", help="Seconds without changes before a re-import starts"),
+    force: bool = typer.Option(False, "--force", "-f", help="Import plugins that are unchanged since the last import"),
 ):
     """
-    Scan a folder and optionally import its contents.
+    Scan a folder for plugins and optionally import them.
     """
-    if folder:
-        typer.echo(f"Scanning folder: {folder}")
-    else:
-        typer.echo("Scanning the current directory...")
+    plugin_configs = plugin_import.sort_plugins(plugin_import.scan(folder, ignore=ignore, max_depth=max_depth))
+    for plugin_config in plugin_configs:
+        typer.echo(f"{plugin_config.name}: {plugin_config.path}")
 
     if import_flag:
-        typer.echo("Import flag is enabled. Importing contents...")
+        plugin_import.import_plugins(plugin_configs, max_parallel=max_parallel, force=force)
+
+    if watch:
+        plugin_watcher.watch(
+            folder or root_config.plugins_path,
+            ignore=ignore,
+            max_depth=max_depth,
+            debounce=debounce,
+            max_parallel=max_parallel,
+        )
+
+
+def _print_plan(plans: dict) -> int:
+    """Print the actions that change something, returns their number."""
+    changes = 0
+    for actions in plans.values():
+        for action in actions:
+            if action.action == NOOP:
+                continue
+            changes += 1
+            reason = f" ({action.reason})" if action.reason else ""
+            typer.echo(f"{action.action:>8}  {action.target} [{action.type}]{reason}")
+    noop = sum(1 for actions in plans.values() for a in actions if a.action == NOOP)
+    typer.echo(f"{changes} to change, {noop} unchanged.")
+    return changes
+
+
+@app.command("plan")
+def plan(
+    folder: Path = typer.Argument(None, help="Folder to scan for plugins, default is the plugins folder"),
+):
+    """
+    Show what an import would create, update or delete, without changing anything.
+    """
+    plugin_configs = plugin_import.sort_plugins(plugin_import.scan(folder))
+    _print_plan(plugin_import.plan_import(plugin_configs))
+
+
+@app.command("apply")
+def apply(
+    folder: Path = typer.Argument(None, help="Folder to scan for plugins, default is the plugins folder"),
+    max_parallel: int = typer.Option(4, "--max-parallel", help="Max number of plugins imported at once"),
+):
+    """
+    Import the plugins that have changes, only the changed resources are provisioned.
+    """
+    plugin_configs = plugin_import.sort_plugins(plugin_import.scan(folder))
+    plans = plugin_import.plan_import(plugin_configs)
+    if not _print_plan(plans):
+        return
+    changed = [p for p in plugin_configs if any(a.action != NOOP for a in plans[p.name])]
+    plugin_import.import_plugins(changed, max_parallel=max_parallel, force=True)
+
+
+def _stack_plugins(plugins: list[str]) -> list[PluginConfig] | None:
+    if not plugins:
+        return None
+    plugin_configs = [PluginConfig(name, lazy=True) for name in plugins]
+    missing = prefetch(plugin_configs)
+    if missing:
+        raise typer.BadParameter(f"Unknown plugins: {[p.name for p in missing]}")
+    return plugin_configs
+
+
+@app.command("up")
+def up(
+    plugins: list[str] = typer.Argument(None, help="Plugins to start, default all imported plugins"),
+    max_parallel: int = typer.Option(8, "--max-parallel", help="Max number of plugins started at once"),
+    deadline: float = typer.Option(120.0, "--deadline", help="Seconds to wait for a plugin to be ready"),
+    merged: bool = typer.Option(
+        False, "--merged", help="Start all plugins as one compose project, compose handles the ordering"
+    ),
+):
+    """
+    Start the stack, in dependency waves, each wave waits for its plugins to be ready.
+    """
+    if merged:
+        compose_merge.merged_up(_stack_plugins(plugins))
+        return
+    stack.stack_up(_stack_plugins(plugins), max_parallel=max_parallel, deadline=deadline)
+
+
+@app.command("down")
+def down(
+    plugins: list[str] = typer.Argument(None, help="Plugins to stop, default all imported plugins"),
+    max_parallel: int = typer.Option(8, "--max-parallel", help="Max number of plugins stopped at once"),
+    merged: bool = typer.Option(False, "--merged", help="Stop the merged compose project started with up --merged"),
+):
+    """
+    Stop the stack, dependents before their dependencies.
+    """
+    if merged:
+        compose_merge.merged_down()
+        return
+    stack.stack_down(_stack_plugins(plugins), max_parallel=max_parallel)
+
+
+@app.command("compose")
+def compose(
+    force: bool = typer.Option(False, "--force", "-f", help="Regenerate even if nothing changed"),
+):
+    """
+    Write the merged compose file of the stack (all imported plugins) and print its path.
+    """
+    typer.echo(compose_merge.merged_compose_file(force=force))
+
+
+@app.command("status")
+def status(
+    as_json: bool = typer.Option(False, "--json", help="Print the status as json"),
+    timeout: float = typer.Option(3.0, "--timeout", help="Seconds all probes together may take"),
+):
+    """
+    Show the health of vault and every plugin: containers, declared ports and ui uris, probed in parallel.
+    """
+    result = stack_status.collect_status(timeout=timeout)
+    if as_json:
+        typer.echo(json.dumps(result, indent=2))
     else:
-        typer.echo("Import flag is disabled. No import will be performed.")
+        typer.echo(stack_status.format_table(result))
+    if not result["ok"]:
+        raise typer.Exit(1)
 
 
 @app.command("import")
-def importx(folder: Path = typer.Argument(..., help="Optional folder name to scan")):
+def importx(
+    folder: Path = typer.Argument(None, help="Plugin folder, or a folder to scan for plugins"),
+    affected_by: str = typer.Option(
+        None, "--affected-by", help="Re-import this plugin and all plugins depending on it"
+    ),
+    max_parallel: int = typer.Option(4, "--max-parallel", help="Max number of plugins imported at once"),
+    force: bool = typer.Option(False, "--force", "-f", help="Import plugins that are unchanged since the last import"),
+):
     """
     import a plugin
     """
-    if folder:
-        typer.echo(f"Importing: {folder}")
+    if affected_by:
+        plugin_import.import_affected(affected_by, max_parallel=max_parallel)
+        return
+    if not folder:
+        raise typer.BadParameter("Provide a plugin folder or --affected-by")
+    typer.echo(f"Importing: {folder}")
+    plugin_configs = plugin_import.sort_plugins(plugin_import.scan(folder))
+    plugin_import.import_plugins(plugin_configs, max_parallel=max_parallel, force=force)
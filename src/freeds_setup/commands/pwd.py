@@ -1,7 +1,7 @@
 import typer
 import pyperclip
 from freeds_setup.helpers.flog import logger
-from freeds_setup.helpers.bao_client import BaoClient
+from freeds_setup.helpers.bao_client import get_bao_client
 pwd_app = typer.Typer(help="Get passwords to clipboard")
 
 
@@ -10,7 +10,7 @@ def init_freeds():
     """
     Print and copy openbao admin password to clipboard.
     """
-    bao = BaoClient()
+    bao = get_bao_client()
     bao.retrieve_tokens_from_logs()
     print(f"Bao root token: {bao.root_token}")
     pyperclip.copy(bao.root_token)
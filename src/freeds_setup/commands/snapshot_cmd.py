@@ -0,0 +1,30 @@
+import typer
+from pathlib import Path
+from freeds_setup.helpers import snapshot
+from freeds_setup.helpers.flog import logger
+
+snapshot_app = typer.Typer(help="Export and import all plugin config in one go")
+
+
+@snapshot_app.command("export")
+def export_snapshot(
+    file: Path = typer.Argument(..., help="Snapshot file, use a .gz suffix to compress"),
+):
+    """
+    Export the config of all plugins in the vault to a snapshot file.
+    """
+    logger.commence(f"Exporting snapshot to {file}")
+    snapshot.export_snapshot(file)
+    logger.complete()
+
+
+@snapshot_app.command("import")
+def import_snapshot(
+    file: Path = typer.Argument(..., exists=True, dir_okay=False, help="Snapshot file to restore"),
+):
+    """
+    Restore plugin config from a snapshot file into the vault.
+    """
+    logger.commence(f"Importing snapshot from {file}")
+    snapshot.import_snapshot(file)
+    logger.complete()
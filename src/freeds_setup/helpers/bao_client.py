@@ -1,14 +1,43 @@
+import copy
 import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
 import requests
+from requests.adapters import HTTPAdapter
 import subprocess
-from typing import Optional
+from typing import Iterable, Optional
 from freeds_setup.helpers.root_config import root_config
 from freeds_setup.helpers.flog import logger
+from freeds_setup.helpers.config_cache import ConfigCache
+from freeds_setup.helpers.files import atomic_write
+from freeds_setup.helpers.resilience import AdaptiveLimiter, CircuitBreaker, CircuitOpenError, backoff_delay
 import pyperclip
 
 
+WRITE_MODES = ("merge", "patch", "cas")
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE")
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+SERVER_FAILURE_CODES = (500, 502, 503, 504)
+UNSEAL_KEY_PATTERN = re.compile(r"Unseal Key: (\S+)")
+ROOT_TOKEN_PATTERN = re.compile(r"Root Token: (\S+)")
+
+
+def merge_patch(target: dict, patch: dict) -> dict:
+    """Apply a JSON merge patch (RFC 7386) to target in place, the same merge vault does for KV v2 PATCH."""
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge_patch(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+    return target
+
+
 class BaoPaths:
     def __init__(self):
         self.mount = "config"
@@ -38,7 +67,13 @@ class BaoClient:
     unseal method seems lost, but npone of that is used since I discvovered auto-unseal.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        pool_size: int = 16,
+        disk_cache: bool = False,
+        trust_seconds: float = 1.0,
+        write_mode: str = "cas",
+    ):
         self.root_token_file = root_config.known_location / ".bao_root"
         self.unseal_token_file = root_config.known_location / ".bao_unseal"
 
@@ -46,9 +81,30 @@ class BaoClient:
         self.unseal_token: Optional[str] = self._get_content(self.unseal_token_file)
 
         self.timeout = 5
+        # size the connection pool for read_many, the default of 10 makes extra workers open throwaway connections
+        self.pool_size = pool_size
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         self.paths = BaoPaths()
 
+        # read through cache, entries are checked against the KV v2 metadata version before use,
+        # unless they were confirmed less than trust_seconds ago
+        cache_dir = root_config.known_location / "cache" / "config" if disk_cache else None
+        self.cache = ConfigCache(cache_dir=cache_dir)
+        self.trust_seconds = trust_seconds
+
+        if write_mode not in WRITE_MODES:
+            raise ValueError(f"Unknown write mode: {write_mode}, expected one of {WRITE_MODES}")
+        self.write_mode = write_mode
+        self.cas_retries = 5
+
+        # protect a small vault from our own fan-out, see helpers/resilience.py
+        self.retries = 3
+        self.limiter = AdaptiveLimiter(initial=min(8, pool_size), max_limit=pool_size)
+        self.breaker = CircuitBreaker()
+
     def _get_content(self, file_path: Path) -> Optional[str]:
         if file_path.exists():
             with open(file_path, "r") as f:
@@ -62,54 +118,227 @@ class BaoClient:
             h["X-Vault-Token"] = self.root_token
         return h
 
+    def _request(self, method: str, url: str, headers: dict = None, **kwargs) -> requests.Response:
+        """Send a request through the concurrency limiter and circuit breaker.
+        Idempotent requests are retried with backoff on connection errors, timeouts and 429/5xx responses.
+        Returns the last response, callers handle the status code as before."""
+        attempts = self.retries + 1 if method in IDEMPOTENT_METHODS else 1
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                raise CircuitOpenError(
+                    f"Vault at {self.paths.uri} keeps failing, not sending requests for {self.breaker.retry_in:.1f}s."
+                )
+            start = time.monotonic()
+            try:
+                with self.limiter.slot():
+                    result = self.session.request(
+                        method, url, headers=headers or self.header(), timeout=self.timeout, **kwargs
+                    )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.limiter.record(time.monotonic() - start, overloaded=True)
+                self.breaker.failure()
+                if attempt + 1 >= attempts:
+                    raise
+                logger.debug(f"{method} {url} failed: {e}, retrying")
+            except BaseException:
+                # anything else (ssl, broken chunked response, ...) isn't retried but must still close a half open
+                # circuit's trial, the breaker would refuse every request otherwise
+                self.breaker.failure()
+                raise
+            else:
+                overloaded = result.status_code in RETRY_STATUS_CODES
+                self.limiter.record(time.monotonic() - start, overloaded=overloaded)
+                if result.status_code in SERVER_FAILURE_CODES:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+                if not overloaded or attempt + 1 >= attempts:
+                    return result
+                logger.debug(f"{method} {url} answered {result.status_code}, retrying")
+            time.sleep(backoff_delay(attempt))
+
     def read_plugin_vault_entry(self, plugin: str = None) -> dict:
         """Read plugin config from vault."""
         if not plugin:
             raise ValueError("plugin required")
 
-        result = self.session.get(
-            self.paths.plugin_path(plugin), headers=self.header(), timeout=self.timeout
-        )
+        result = self._request("GET", self.paths.plugin_path(plugin))
         if result.status_code == 404:
             return {}
         return result.json()
 
-    def read_plugin_config(self, plugin: str = None) -> dict:
-        """Read plugin config from vault."""
-        data = self.read_plugin_vault_entry(plugin)
-        return data.get("data", {}).get("data", {})
+    def read_plugin_version(self, plugin: str) -> Optional[int]:
+        """Read the current version of a plugin's config from the metadata endpoint, None if it doesn't exist."""
+        result = self._request("GET", self.paths.plugin_meta_path(plugin))
+        if result.status_code == 404:
+            return None
+        result.raise_for_status()
+        return result.json().get("data", {}).get("current_version")
+
+    def read_plugin_config(self, plugin: str = None, use_cache: bool = True) -> dict:
+        """Read plugin config from vault.
+        The payload is only downloaded if the cached copy is missing or the vault version has moved on."""
+        if not plugin:
+            raise ValueError("plugin required")
+        entry = self.cache.get(plugin) if use_cache else None
+        if entry:
+            if entry.age < self.trust_seconds:
+                return copy.deepcopy(entry.data)
+            version = self.read_plugin_version(plugin)
+            if version is None:
+                self.cache.invalidate(plugin)
+                return {}
+            if version == entry.version:
+                self.cache.confirm(plugin)
+                return copy.deepcopy(entry.data)
+
+        data = self.read_plugin_vault_entry(plugin).get("data") or {}
+        config = data.get("data") or {}
+        version = (data.get("metadata") or {}).get("version")
+        if version:
+            self.cache.put(plugin, version, config)
+        return config
+
+    def read_many(self, plugins: Iterable[str], max_workers: int = None) -> dict[str, dict]:
+        """Read config for several plugins concurrently, returns a dict of plugin name -> config.
+        Fan-out is threads on the pooled session, so every call goes through the same limiter, breaker and cache.
+        A stack has tens of plugins and the limiter keeps a small vault at a handful of requests in flight,
+        an asyncio client wouldn't get more calls through."""
+        plugins = list(plugins)
+        if not plugins:
+            return {}
+        workers = min(max_workers or self.pool_size, len(plugins))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bao") as pool:
+            configs = pool.map(self.read_plugin_config, plugins)
+            return dict(zip(plugins, configs))
+
+    def write_many(self, configs: dict[str, dict], mode: str = None, max_workers: int = None) -> None:
+        """Write config for several plugins concurrently, configs is a dict of plugin name -> config."""
+        if not configs:
+            return
+        workers = min(max_workers or self.pool_size, len(configs))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bao") as pool:
+            futures = [pool.submit(self.write_plugin_config, p, c, mode) for p, c in configs.items()]
+            for future in futures:
+                future.result()
 
     def delete_plugin_config(self, plugin: str) -> None:
         """Hard delete plugin config from vault."""
-        result = self.session.delete(
-            self.paths.plugin_meta_path(plugin),
-            headers=self.header(),
-            timeout=self.timeout,
-        )
+        self.cache.invalidate(plugin)
+        result = self._request("DELETE", self.paths.plugin_meta_path(plugin))
         if result.status_code == 404:
             return
         result.raise_for_status()
 
-    def write_plugin_config(self, plugin: str, config: dict) -> None:
-        """Write plugin config to vault."""
+    def write_plugin_config(self, plugin: str, config: dict, mode: str = None) -> None:
+        """Write plugin config to vault, the top level keys in config replace the stored ones.
+        mode (default self.write_mode):
+            merge: read, update and write back, the last writer wins.
+            cas: like merge but the write is conditional on the version it was based on and retried on conflict.
+                 The cached copy is used as base, so with a warm cache it's a single round trip.
+            patch: send only the given keys with KV v2 PATCH, see patch_plugin_config.
+        """
         if plugin is None:
             raise ValueError("plugin required")
-        existing = self.read_plugin_config(plugin)
-        existing.update(config)
-        data = {"data": existing}
-        result = self.session.post(
-            self.paths.plugin_path(plugin),
-            headers=self.header(),
-            json=data,
-            timeout=self.timeout,
+        mode = mode or self.write_mode
+        if mode == "patch":
+            self.patch_plugin_config(plugin, config)
+        elif mode == "cas":
+            self._write_cas(plugin, config)
+        elif mode == "merge":
+            existing = self.read_plugin_config(plugin)
+            existing.update(config)
+            self.cache.invalidate(plugin)
+            result = self._post_config(plugin, existing)
+            result.raise_for_status()
+            self._cache_written(plugin, result, existing)
+        else:
+            raise ValueError(f"Unknown write mode: {mode}, expected one of {WRITE_MODES}")
+
+    def patch_plugin_config(self, plugin: str, config: dict) -> None:
+        """Merge config into the stored config in one round trip using KV v2 PATCH.
+        This is a JSON merge patch, nested dicts are merged key by key and a None value deletes the key."""
+        if plugin is None:
+            raise ValueError("plugin required")
+        headers = self.header()
+        headers["Content-Type"] = "application/merge-patch+json"
+        result = self._request("PATCH", self.paths.plugin_path(plugin), headers=headers, json={"data": config})
+        if result.status_code == 404:
+            # PATCH can't create a secret, create it with a check-and-set write
+            self._write_cas(plugin, config)
+            return
+        result.raise_for_status()
+
+        # keep the cache if we hold the version the patch was applied to, otherwise we don't know the result
+        version = result.json().get("data", {}).get("version")
+        entry = self.cache.get(plugin)
+        if version and entry and entry.version == version - 1:
+            self.cache.put(plugin, version, merge_patch(copy.deepcopy(entry.data), config))
+        else:
+            self.cache.invalidate(plugin)
+
+    def _write_cas(self, plugin: str, config: dict) -> None:
+        """Read-modify-write with options.cas, retried with a fresh read when another writer got there first."""
+        for attempt in range(self.cas_retries + 1):
+            # first attempt trusts the cache, a stale base is caught by vault and costs a retry
+            version, existing = self.read_versioned(plugin, use_cache=attempt == 0)
+            existing.update(config)
+            result = self._post_config(plugin, existing, cas=version)
+            if self._is_cas_conflict(result):
+                logger.debug(f"Version conflict writing {plugin} at version {version}, retrying")
+                self.cache.invalidate(plugin)
+                time.sleep(backoff_delay(attempt, base=0.05))
+                continue
+            result.raise_for_status()
+            self._cache_written(plugin, result, existing)
+            return
+        raise RuntimeError(
+            f"Writing config for {plugin} failed, it was changed by someone else {self.cas_retries + 1} times."
         )
+
+    def read_versioned(self, plugin: str, use_cache: bool = True) -> tuple[int, dict]:
+        """Return version and config, version is 0 if the plugin doesn't exist (which is the cas value for create).
+        A cached copy is returned without checking, use it as base for a check-and-set write."""
+        entry = self.cache.get(plugin) if use_cache else None
+        if entry:
+            return entry.version, copy.deepcopy(entry.data)
+        data = self.read_plugin_vault_entry(plugin).get("data") or {}
+        version = (data.get("metadata") or {}).get("version") or 0
+        config = data.get("data") or {}
+        if version:
+            self.cache.put(plugin, version, config)
+        return version, config
+
+    def replace_plugin_config(self, plugin: str, config: dict, cas: int) -> bool:
+        """Replace the whole config if the stored version is still cas, returns False if it was changed meanwhile."""
+        result = self._post_config(plugin, config, cas=cas)
+        if self._is_cas_conflict(result):
+            self.cache.invalidate(plugin)
+            return False
         result.raise_for_status()
+        self._cache_written(plugin, result, config)
+        return True
+
+    def _post_config(self, plugin: str, config: dict, cas: int = None) -> requests.Response:
+        body = {"data": config}
+        if cas is not None:
+            body["options"] = {"cas": cas}
+        return self._request("POST", self.paths.plugin_path(plugin), json=body)
+
+    def _is_cas_conflict(self, result: requests.Response) -> bool:
+        return result.status_code == 400 and "check-and-set" in result.text
+
+    def _cache_written(self, plugin: str, result: requests.Response, config: dict) -> None:
+        """The write response carries the new version, cache what we wrote so the next read is only a version check."""
+        version = result.json().get("data", {}).get("version")
+        if version:
+            self.cache.put(plugin, version, config)
+        else:
+            self.cache.invalidate(plugin)
 
     def post_raw(self, path: str, body=None) -> dict:
         """POST to vault, return response json or raise."""
-        result = self.session.post(
-            path, headers=self.header(), json=body, timeout=self.timeout
-        )
+        result = self._request("POST", path, json=body)
         if result.status_code == 204:
             return {}
         if not result.ok:
@@ -119,9 +348,7 @@ class BaoClient:
 
     def is_initialized(self) -> bool:
         """Check if vault is initialized."""
-        r = self.session.get(
-            self.paths.init_path, headers=self.header(), timeout=self.timeout
-        )
+        r = self._request("GET", self.paths.init_path)
         if not r.ok:
             raise RuntimeError(
                 f"is_initialized failed, is vault running?: {r.status_code} {r.text}"
@@ -130,11 +357,7 @@ class BaoClient:
 
     def initialize(self):
         """Initialize vault and store tokens."""
-        mounts = self.session.get(
-            f"{self.paths.v1_path}/sys/mounts",
-            headers=self.header(),
-            timeout=self.timeout,
-        )
+        mounts = self._request("GET", f"{self.paths.v1_path}/sys/mounts")
         # Check if the 'config/' path is already in the mounts
         if f"{self.paths.mount}/" in mounts.json():
             logger.info(f"Vault mount already enabled: '{self.paths.mount}'")
@@ -145,30 +368,85 @@ class BaoClient:
         )
         self.retrieve_tokens_from_logs()
 
-    def retrieve_tokens_from_logs(self):
-        """Retrieve tokens from vault logs and store them in the well-known location."""
-
-        log_command = ["docker", "logs", "vault"]
-
-        # Retrieve the logs from the Vault container
-        logs = subprocess.check_output(log_command, stderr=subprocess.STDOUT, text=True)
-
-        # Find the last occurrence of the Unseal Key and Root Token
-        unseal_key_match = re.findall(r"Unseal Key: (\S+)", logs)
-        root_token_match = re.findall(r"Root Token: (\S+)", logs)
+    def retrieve_tokens_from_logs(self, container: str = "vault", force: bool = False) -> None:
+        """Retrieve tokens from vault logs and store them in the well-known location.
+        The stored tokens are reused as long as they were written after the container was started.
+        Otherwise the log of the current container run is read from the end, in windows that grow until
+        the most recent Unseal Key and Root Token are found, so a long log is never loaded as a whole."""
+        started_at = self._container_started_at(container)
+        if not force and started_at and self._token_files_fresh(started_at):
+            self.root_token = self._get_content(self.root_token_file)
+            self.unseal_token = self._get_content(self.unseal_token_file)
+            logger.debug("Using stored vault tokens, they are newer than the vault container.")
+            return
 
-        if not unseal_key_match or not root_token_match:
-            raise RuntimeError("Unseal Key or Root Token not found in logs.")
+        tail = 500
+        while True:
+            unseal_token, root_token, complete = self._scan_log_window(container, since=started_at, tail=tail)
+            if unseal_token and root_token:
+                break
+            if complete:
+                raise RuntimeError("Unseal Key or Root Token not found in logs.")
+            tail *= 8
 
-        # Get the last occurrences
-        self.unseal_key = unseal_key_match[-1]
-        self.root_token = root_token_match[-1]
+        self.unseal_token = unseal_token
+        self.root_token = root_token
 
         # Store the tokens in the well-known location
-        with open(self.root_token_file, "w") as f:
-            f.write(self.root_token)
-        with open(self.root_token_file, "w") as f:
-            f.write(self.root_token)
+        self._write_secret_file(self.root_token_file, self.root_token)
+        self._write_secret_file(self.unseal_token_file, self.unseal_token)
+
+    def _scan_log_window(self, container: str, since: Optional[str], tail: int) -> tuple[Optional[str], Optional[str], bool]:
+        """Stream the last tail lines of the container log and keep the last token matches.
+        Returns unseal token, root token and whether the window covered the whole log."""
+        log_command = ["docker", "logs", "--tail", str(tail)]
+        if since:
+            log_command += ["--since", since]
+        log_command.append(container)
+
+        unseal_token = root_token = None
+        lines = 0
+        with subprocess.Popen(log_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True) as proc:
+            for line in proc.stdout:
+                lines += 1
+                match = UNSEAL_KEY_PATTERN.search(line)
+                if match:
+                    unseal_token = match.group(1)
+                    continue
+                match = ROOT_TOKEN_PATTERN.search(line)
+                if match:
+                    root_token = match.group(1)
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, log_command)
+        return unseal_token, root_token, lines < tail
+
+    def _container_started_at(self, container: str) -> Optional[str]:
+        """Return the container start time as reported by docker (RFC 3339), None if it can't be inspected."""
+        try:
+            started_at = subprocess.check_output(
+                ["docker", "inspect", "-f", "{{.State.StartedAt}}", container],
+                stderr=subprocess.DEVNULL,
+                text=True,
+            ).strip()
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            return None
+        return started_at or None
+
+    def _token_files_fresh(self, started_at: str) -> bool:
+        """True if both token files exist and were written after the container started."""
+        match = re.match(r"(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)", started_at)
+        if not match:
+            return False
+        started = datetime.strptime(match.group(1), "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+        for token_file in (self.root_token_file, self.unseal_token_file):
+            if not token_file.exists():
+                return False
+            if token_file.stat().st_mtime < started.timestamp():
+                return False
+        return True
+
+    def _write_secret_file(self, file_path: Path, content: str) -> None:
+        atomic_write(file_path, content, mode=0o600)
 
     def close(self):
         self.session.close()
@@ -177,11 +455,7 @@ class BaoClient:
         """List all plugins in the vault"""
         url = f"{self.paths.metadata_path}?list=true"
 
-        r = self.session.get(
-            url,
-            headers=self.header(),
-            timeout=self.timeout,
-        )
+        r = self._request("GET", url)
         if r.status_code == 404:
             return []
         r.raise_for_status()
@@ -189,9 +463,23 @@ class BaoClient:
         return keys
 
 
+_shared_client: Optional[BaoClient] = None
+_shared_lock = threading.Lock()
+
+
+def get_bao_client() -> BaoClient:
+    """Return the process wide BaoClient, it's created on first use and then reused by all callers."""
+    global _shared_client
+    if _shared_client is None:
+        with _shared_lock:
+            if _shared_client is None:
+                _shared_client = BaoClient(disk_cache=os.environ.get("FDS_BAO_DISK_CACHE") == "1")
+    return _shared_client
+
+
 
 if __name__ == "__main__":
-    bao = BaoClient()
+    bao = get_bao_client()
     print(bao.list_plugins())
     # root_config.set_env()
     # bao = BaoClient()
@@ -0,0 +1,318 @@
+"""Merge the compose files of all plugins into one compose project, so the stack starts with one docker compose call
+and compose can start services of different plugins in parallel.
+
+Each plugin's compose file is interpolated with the plugin's env (its .env and its config from the config store),
+so the merged file needs no env files. Services are renamed <plugin>-<service> and keep the old service name as a
+network alias, volumes and networks keep the names they had in the plugin's own project, so existing data is used.
+Services depend on the services of the plugins their plugin depends on.
+
+The merged file is ~/.freeds/compose/docker-compose.yaml, it's only regenerated when one of its inputs changed.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Iterable, Optional
+import yaml
+from freeds_setup.helpers import dc
+from freeds_setup.helpers.flog import logger
+from freeds_setup.helpers.files import atomic_write
+from freeds_setup.helpers.root_config import root_config
+from freeds_setup.helpers.stack import compose_plugins
+from freeds_setup.helpers.yaml_cache import load_yaml
+from freeds_setup.importing.plugin_config import PluginConfig
+
+PROJECT = "freeds"
+HEADER = "# Generated by freeds-setup from the plugin compose files, don't edit. fingerprint: "
+
+# $$, ${NAME}, ${NAME:-default} (and -, :?, ?, :+, +), $NAME
+_VARIABLE = re.compile(
+    r"\$(?:(\$)|\{([A-Za-z_][A-Za-z0-9_]*)(?:(:?[-?+])((?:[^{}]|\{[^{}]*\})*))?\}|([A-Za-z_][A-Za-z0-9_]*))"
+)
+_REFERENCED = re.compile(rb"\$\{?([A-Za-z_][A-Za-z0-9_]*)")
+
+
+def compose_dir() -> Path:
+    return root_config.known_location / "compose"
+
+
+def interpolate(value: str, env: dict, where: str) -> str:
+    """Resolve compose variable syntax in value, the result is plain text (no $ escapes)."""
+
+    def replace(match: re.Match) -> str:
+        if match.group(1):
+            return "$"
+        name = match.group(2) or match.group(5)
+        op, arg = match.group(3), match.group(4) or ""
+        current = env.get(name)
+        if op == ":-":
+            return current if current else interpolate(arg, env, where)
+        if op == "-":
+            return current if current is not None else interpolate(arg, env, where)
+        if op == ":+":
+            return interpolate(arg, env, where) if current else ""
+        if op == "+":
+            return interpolate(arg, env, where) if current is not None else ""
+        if op in (":?", "?") and (current is None or (op == ":?" and not current)):
+            raise ValueError(f"{where}: required variable {name} is missing: {arg}")
+        if current is None:
+            logger.warning(f"{where}: variable {name} is not set, using an empty string")
+            return ""
+        return current
+
+    return _VARIABLE.sub(replace, value)
+
+
+def _interpolate_all(data, env: dict, where: str):
+    """Interpolate every string value, keys are left alone like compose does.
+    The results are escaped again, compose interpolates the merged file once more."""
+    if isinstance(data, dict):
+        return {key: _interpolate_all(value, env, where) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_interpolate_all(value, env, where) for value in data]
+    if isinstance(data, str):
+        return interpolate(data, env, where).replace("$", "$$")
+    return data
+
+
+def read_dotenv(path: Path) -> dict[str, str]:
+    """Read a .env file, KEY=VALUE lines with optional export and quotes."""
+    env = {}
+    if not path.exists():
+        return env
+    for line in path.read_text().splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        key = key.strip().removeprefix("export ").strip()
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+            value = value[1:-1]
+        env[key] = value
+    return env
+
+
+def plugin_env(plugin_config: PluginConfig) -> dict[str, str]:
+    """The variables compose sees for a plugin, like for up: its config, then its .env,
+    then the shell environment without FDS_ variables (see dc.compose_environment)."""
+    dot_env = plugin_config.path / ".env"
+    env = dc.compose_environment([dot_env], read_dotenv(dot_env))
+    env.update(plugin_config.get_env())
+    return env
+
+
+def _resolve(base: Path, path: str) -> str:
+    if path.startswith("~"):
+        return os.path.expanduser(path)
+    return path if os.path.isabs(path) else os.path.normpath(base / path)
+
+
+def _top_level(plugin: str, kind: str, entries: Optional[dict], base: Path) -> dict:
+    """Rename top level volumes/networks/configs/secrets to <plugin>_<name>, keeping the name docker knows them by."""
+    result = {}
+    for key, value in (entries or {}).items():
+        value = dict(value or {})
+        if kind in ("volumes", "networks") and "name" not in value:
+            # external ones are called by their own name, the others got the plugin's project prefix
+            value["name"] = key if value.get("external") else f"{plugin}_{key}"
+        if "file" in value:
+            value["file"] = _resolve(base, value["file"])
+        result[f"{plugin}_{key}"] = value
+    return result
+
+
+def _service_volume(plugin: str, volume, named: set[str], base: Path):
+    if isinstance(volume, dict):
+        volume = dict(volume)
+        source = volume.get("source")
+        if source and volume.get("type", "volume") == "volume" and source in named:
+            volume["source"] = f"{plugin}_{source}"
+        elif source and volume.get("type") == "bind":
+            volume["source"] = _resolve(base, source)
+        return volume
+    parts = volume.split(":")
+    if len(parts) == 1:
+        # anonymous volume
+        return volume
+    source = parts[0]
+    if source in named:
+        parts[0] = f"{plugin}_{source}"
+    elif source.startswith((".", "~", "/")):
+        parts[0] = _resolve(base, source)
+    return ":".join(parts)
+
+
+def _service(plugin: str, name: str, service: dict, top: dict, base: Path) -> dict:
+    """Rewrite one service of a plugin for the merged project."""
+    service = dict(service)
+
+    def rename(other: str) -> str:
+        return f"{plugin}-{other}"
+
+    depends_on = service.get("depends_on") or {}
+    if isinstance(depends_on, list):
+        depends_on = {d: {"condition": "service_started"} for d in depends_on}
+    service["depends_on"] = {rename(d): c for d, c in depends_on.items()}
+
+    network_mode = service.get("network_mode", "")
+    if network_mode.startswith("service:"):
+        service["network_mode"] = "service:" + rename(network_mode.split(":", 1)[1])
+    elif not network_mode:
+        networks = service.get("networks") or ["default"]
+        if isinstance(networks, list):
+            networks = {n: None for n in networks}
+        merged_networks = {}
+        for network, settings in networks.items():
+            settings = dict(settings or {})
+            # the old service name still resolves, for the other services of the plugin
+            settings["aliases"] = sorted(set(settings.get("aliases", [])) | {name})
+            merged_networks[f"{plugin}_{network}"] = settings
+        service["networks"] = merged_networks
+
+    named = set(top.get("volumes") or {})
+    if "volumes" in service:
+        service["volumes"] = [_service_volume(plugin, v, named, base) for v in service["volumes"]]
+    for kind in ("configs", "secrets"):
+        refs = []
+        for ref in service.get(kind, []):
+            if isinstance(ref, str):
+                # the short form mounts at the name, keep that target for the renamed source
+                ref = {"source": ref, "target": ref if kind == "secrets" else f"/{ref}"}
+            refs.append({**ref, "source": f"{plugin}_{ref['source']}"})
+        if refs:
+            service[kind] = refs
+
+    build = service.get("build")
+    if isinstance(build, str):
+        service["build"] = _resolve(base, build)
+    elif isinstance(build, dict):
+        service["build"] = {**build, "context": _resolve(base, build.get("context", "."))}
+
+    env_file = service.get("env_file")
+    if env_file:
+        env_files = env_file if isinstance(env_file, list) else [env_file]
+        service["env_file"] = [
+            _resolve(base, f) if isinstance(f, str) else {**f, "path": _resolve(base, f["path"])} for f in env_files
+        ]
+
+    if "links" in service:
+        service["links"] = [f"{rename(link.split(':')[0])}:{link.split(':')[-1]}" for link in service["links"]]
+    if "extends" in service:
+        logger.warning(f"Service {name} of {plugin} uses extends, that isn't supported in the merged project.")
+    return service
+
+
+def merge_plugins(plugin_configs: list[PluginConfig]) -> dict:
+    """Build the merged compose project of the plugins."""
+    merged = {"name": PROJECT, "services": {}, "networks": {}, "volumes": {}, "configs": {}, "secrets": {}}
+    services_of: dict[str, dict[str, dict]] = {}
+    for plugin_config in plugin_configs:
+        plugin = plugin_config.name
+        base = plugin_config.path
+        compose_file = base / "docker-compose.yaml"
+        data = _interpolate_all(copy.deepcopy(load_yaml(compose_file)), plugin_env(plugin_config), str(compose_file))
+
+        networks = dict(data.get("networks") or {})
+        networks.setdefault("default", None)
+        merged["networks"].update(_top_level(plugin, "networks", networks, base))
+        for kind in ("volumes", "configs", "secrets"):
+            merged[kind].update(_top_level(plugin, kind, data.get(kind), base))
+
+        services_of[plugin] = data.get("services") or {}
+        for name, service in services_of[plugin].items():
+            merged["services"][f"{plugin}-{name}"] = _service(plugin, name, service, data, base)
+
+    # services wait for the services of the plugins their plugin depends on, for healthy if they have a healthcheck
+    for plugin_config in plugin_configs:
+        for dependency in plugin_config.dependencies:
+            for dep_name, dep_service in services_of.get(dependency, {}).items():
+                healthcheck = dep_service.get("healthcheck")
+                healthy = healthcheck and not healthcheck.get("disable")
+                condition = "service_healthy" if healthy else "service_started"
+                for name in services_of[plugin_config.name]:
+                    depends_on = merged["services"][f"{plugin_config.name}-{name}"]["depends_on"]
+                    depends_on[f"{dependency}-{dep_name}"] = {"condition": condition}
+
+    for service in merged["services"].values():
+        if not service["depends_on"]:
+            del service["depends_on"]
+    return {key: value for key, value in merged.items() if value}
+
+
+def inputs_fingerprint(plugin_configs: list[PluginConfig]) -> str:
+    """Hash of everything the merged file is made from: compose files, .env files, plugin config, dependencies
+    and the shell variables the compose files refer to."""
+    digest = hashlib.sha256()
+    referenced = set()
+    for plugin_config in sorted(plugin_configs, key=lambda p: p.name):
+        compose = (plugin_config.path / "docker-compose.yaml").read_bytes()
+        dot_env = plugin_config.path / ".env"
+        referenced.update(m.decode() for m in _REFERENCED.findall(compose))
+        item = {
+            "plugin": plugin_config.name,
+            "path": str(plugin_config.path),
+            "compose": hashlib.sha256(compose).hexdigest(),
+            "dotenv": hashlib.sha256(dot_env.read_bytes()).hexdigest() if dot_env.exists() else None,
+            "env": plugin_config.get_env(),
+            "dependencies": sorted(plugin_config.dependencies),
+        }
+        digest.update(json.dumps(item, sort_keys=True).encode())
+    shell = {name: os.environ.get(name) for name in sorted(referenced) if not name.startswith("FDS_")}
+    digest.update(json.dumps(shell, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def merged_compose_file(plugin_configs: Iterable[PluginConfig] = None, force: bool = False) -> Path:
+    """Write the merged compose file for the plugins (default all with a compose file) if its inputs changed.
+    merged_up and merged_down expect the file to hold the whole stack."""
+    plugin_configs = compose_plugins(plugin_configs)
+    path = compose_dir() / "docker-compose.yaml"
+    fingerprint = inputs_fingerprint(plugin_configs)
+    if not force and path.exists():
+        with open(path, "r") as f:
+            if f.readline().strip() == HEADER + fingerprint:
+                logger.debug(f"Merged compose file {path} is up to date.")
+                return path
+
+    merged = merge_plugins(plugin_configs)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # the file holds the plugin config, passwords included
+    atomic_write(path, HEADER + fingerprint + "\n" + yaml.safe_dump(merged, sort_keys=False), mode=0o600)
+    logger.info(f"Wrote merged compose file for {len(plugin_configs)} plugins: {path}")
+    return path
+
+
+def plugin_services(plugin_configs: Iterable[PluginConfig]) -> list[str]:
+    """The names of the plugins' services in the merged project."""
+    services = []
+    for plugin_config in compose_plugins(plugin_configs):
+        data = load_yaml(plugin_config.path / "docker-compose.yaml") or {}
+        services.extend(f"{plugin_config.name}-{name}" for name in data.get("services") or {})
+    return services
+
+
+def merged_up(plugin_configs: Iterable[PluginConfig] = None) -> None:
+    """Start the plugins (default all) as one compose project.
+    The file always holds the whole stack, a subset is started by its service names and compose starts the services
+    they depend on too. The services of the other plugins are left alone."""
+    path = merged_compose_file()
+    args = ["-p", PROJECT, "up", "-d", "--remove-orphans"]
+    if plugin_configs is not None:
+        services = plugin_services(plugin_configs)
+        if not services:
+            logger.info("None of the plugins has a compose file, nothing to start.")
+            return
+        args += services
+    dc.execute_dc(args, work_path=path.parent)
+
+
+def merged_down() -> None:
+    path = compose_dir() / "docker-compose.yaml"
+    if not path.exists():
+        logger.info("No merged compose project to stop.")
+        return
+    dc.execute_dc(["-p", PROJECT, "down"], work_path=path.parent)
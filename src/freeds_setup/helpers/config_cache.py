@@ -0,0 +1,113 @@
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+from freeds_setup.helpers.flog import logger
+from freeds_setup.helpers.files import atomic_write
+
+
+class CacheEntry:
+    def __init__(self, version: int, data: dict):
+        self.version = version
+        self.data = data
+        self.checked = time.monotonic()
+
+    @property
+    def age(self) -> float:
+        """Seconds since the version was last confirmed against vault."""
+        return time.monotonic() - self.checked
+
+
+class ConfigCache:
+    """LRU cache of plugin configs keyed on the KV v2 version.
+    Entries live in memory, if cache_dir is set they are also kept on disk so the next process starts warm.
+    The cache never decides if an entry is current, the caller compares the version with vault metadata.
+    """
+
+    def __init__(self, max_entries: int = 256, cache_dir: Optional[Path] = None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _file(self, plugin: str) -> Path:
+        return self.cache_dir / f"{plugin}.json"
+
+    def _load(self, plugin: str) -> Optional[CacheEntry]:
+        """Load an entry from disk, a broken file is treated as a miss."""
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._file(plugin), "r") as f:
+                stored = json.load(f)
+            entry = CacheEntry(stored["version"], stored["data"])
+            # a disk entry was confirmed in another process, make sure it's checked before use
+            entry.checked = float("-inf")
+            return entry
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _store(self, plugin: str, entry: CacheEntry) -> None:
+        """Write the entry to disk atomically, the configs contain secrets so the file is private to the user."""
+        if not self.cache_dir:
+            return
+        try:
+            atomic_write(self._file(plugin), json.dumps({"version": entry.version, "data": entry.data}), mode=0o600)
+        except OSError as e:
+            logger.warning(f"Failed to write config cache for {plugin}: {e}")
+
+    def get(self, plugin: str) -> Optional[CacheEntry]:
+        """Return the cached entry or None, the entry data must not be modified by the caller."""
+        with self._lock:
+            entry = self._entries.get(plugin)
+            if entry:
+                self._entries.move_to_end(plugin)
+                return entry
+        entry = self._load(plugin)
+        if entry:
+            with self._lock:
+                self._put(plugin, entry)
+        return entry
+
+    def _put(self, plugin: str, entry: CacheEntry) -> None:
+        self._entries[plugin] = entry
+        self._entries.move_to_end(plugin)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, plugin: str, version: int, data: dict) -> None:
+        """Cache a config at the given version, the data is copied."""
+        entry = CacheEntry(version, copy.deepcopy(data))
+        with self._lock:
+            current = self._entries.get(plugin)
+            if current and current.version > version:
+                # a concurrent reader already stored a newer version
+                return
+            self._put(plugin, entry)
+        self._store(plugin, entry)
+
+    def confirm(self, plugin: str) -> None:
+        """Mark an entry as just verified against vault."""
+        with self._lock:
+            entry = self._entries.get(plugin)
+            if entry:
+                entry.checked = time.monotonic()
+
+    def invalidate(self, plugin: str) -> None:
+        """Drop a plugin from the cache, both memory and disk."""
+        with self._lock:
+            self._entries.pop(plugin, None)
+        if self.cache_dir:
+            self._file(plugin).unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self.cache_dir:
+            for path in self.cache_dir.glob("*.json"):
+                path.unlink(missing_ok=True)
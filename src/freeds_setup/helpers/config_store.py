@@ -0,0 +1,226 @@
+"""Where plugin config is stored.
+The vault store is the default, the file store keeps each plugin in a json file and needs no server,
+for dev loops, tests and air-gapped installs. Select with FDS_CONFIG_STORE=vault|file,
+the file store directory is FDS_CONFIG_DIR, default ~/.freeds/config.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional
+from freeds_setup.helpers.bao_client import get_bao_client
+from freeds_setup.helpers.files import atomic_write
+from freeds_setup.helpers.root_config import root_config
+
+
+class ConfigStore(ABC):
+    """Storage for plugin config, one dict per plugin name."""
+
+    @abstractmethod
+    def read(self, plugin: str) -> dict:
+        """Return the plugin config, an empty dict if the plugin doesn't exist."""
+        pass
+
+    @abstractmethod
+    def write(self, plugin: str, config: dict) -> None:
+        """Store config, the top level keys replace the stored ones."""
+        pass
+
+    @abstractmethod
+    def delete(self, plugin: str) -> None:
+        pass
+
+    @abstractmethod
+    def list(self) -> list[str]:
+        """Return the names of all stored plugins, internal entries (starting with _) are not included."""
+        pass
+
+    @abstractmethod
+    def read_versioned(self, name: str) -> tuple[int, dict]:
+        """Return the version and data of an entry, version 0 means it doesn't exist.
+        The version may come from a cache, write_versioned detects if it's stale."""
+        pass
+
+    @abstractmethod
+    def write_versioned(self, name: str, data: dict, version: int) -> bool:
+        """Replace an entry if its version is still version (0 to create), returns False if it was changed."""
+        pass
+
+    def read_many(self, plugins: Iterable[str]) -> dict[str, dict]:
+        """Return a dict of plugin name -> config."""
+        return {plugin: self.read(plugin) for plugin in plugins}
+
+    def write_many(self, configs: dict[str, dict]) -> None:
+        for plugin, config in configs.items():
+            self.write(plugin, config)
+
+    def read_all(self) -> dict[str, dict]:
+        return self.read_many(self.list())
+
+
+class VaultConfigStore(ConfigStore):
+    """Plugin config in the vault config mount, reads and writes are concurrent where possible."""
+
+    def __init__(self):
+        self.bao = get_bao_client()
+
+    def read(self, plugin: str) -> dict:
+        return self.bao.read_plugin_config(plugin)
+
+    def write(self, plugin: str, config: dict) -> None:
+        self.bao.write_plugin_config(plugin, config)
+
+    def delete(self, plugin: str) -> None:
+        self.bao.delete_plugin_config(plugin)
+
+    def list(self) -> list[str]:
+        return [name for name in self.bao.list_plugins() if not name.startswith("_") and not name.endswith("/")]
+
+    def read_versioned(self, name: str) -> tuple[int, dict]:
+        return self.bao.read_versioned(name)
+
+    def write_versioned(self, name: str, data: dict, version: int) -> bool:
+        return self.bao.replace_plugin_config(name, data, cas=version)
+
+    def read_many(self, plugins: Iterable[str]) -> dict[str, dict]:
+        return self.bao.read_many(plugins)
+
+    def write_many(self, configs: dict[str, dict]) -> None:
+        self.bao.write_many(configs)
+
+
+class FileConfigStore(ConfigStore):
+    """Plugin config as <directory>/<plugin>.json.
+    Writes are atomic (temp file + rename). Parsed files are kept in an index and only re-read
+    when their mtime or size changes, so repeated reads cost a stat call."""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._index: dict[str, tuple[tuple[int, int], dict]] = {}
+        self._lock = threading.Lock()
+
+    def _file(self, plugin: str) -> Path:
+        if not plugin or "/" in plugin or plugin.startswith("."):
+            raise ValueError(f"Invalid plugin name: {plugin!r}")
+        return self.directory / f"{plugin}.json"
+
+    def read(self, plugin: str) -> dict:
+        path = self._file(plugin)
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            with self._lock:
+                self._index.pop(plugin, None)
+            return {}
+        signature = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            indexed = self._index.get(plugin)
+            if indexed and indexed[0] == signature:
+                return copy.deepcopy(indexed[1])
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with self._lock:
+            self._index[plugin] = (signature, data)
+        return copy.deepcopy(data)
+
+    def write(self, plugin: str, config: dict) -> None:
+        path = self._file(plugin)
+        # lock covers the read-modify-write so concurrent writers in this process don't lose keys
+        with self._lock:
+            existing = {}
+            if path.exists():
+                with open(path, "r", encoding="utf-8") as f:
+                    existing = json.load(f)
+            existing.update(copy.deepcopy(config))
+            self._write_file(path, existing)
+            st = path.stat()
+            self._index[plugin] = ((st.st_mtime_ns, st.st_size), existing)
+
+    def delete(self, plugin: str) -> None:
+        with self._lock:
+            self._file(plugin).unlink(missing_ok=True)
+            self._index.pop(plugin, None)
+
+    def list(self) -> list[str]:
+        return sorted(p.stem for p in self.directory.glob("*.json") if not p.stem.startswith("_"))
+
+    def read_versioned(self, name: str) -> tuple[int, dict]:
+        """The version of a file entry is a hash of its content, mtimes are too coarse on some filesystems."""
+        with self._lock:
+            content = self._read_bytes(self._file(name))
+        if content is None:
+            return 0, {}
+        return _content_version(content), json.loads(content)
+
+    def write_versioned(self, name: str, data: dict, version: int) -> bool:
+        """Check and replace under the store lock, this is atomic within the process only."""
+        path = self._file(name)
+        with self._lock:
+            content = self._read_bytes(path)
+            current = _content_version(content) if content is not None else 0
+            if current != version:
+                return False
+            self._write_file(path, data)
+            st = path.stat()
+            self._index[name] = ((st.st_mtime_ns, st.st_size), copy.deepcopy(data))
+            return True
+
+    @staticmethod
+    def _read_bytes(path: Path) -> Optional[bytes]:
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _write_file(self, path: Path, data: dict) -> None:
+        atomic_write(path, json.dumps(data, indent=2), mode=0o600)
+
+    def read_many(self, plugins: Iterable[str]) -> dict[str, dict]:
+        plugins = list(plugins)
+        if len(plugins) < 2:
+            return super().read_many(plugins)
+        with ThreadPoolExecutor(max_workers=min(8, len(plugins))) as pool:
+            return dict(zip(plugins, pool.map(self.read, plugins)))
+
+
+def _content_version(content: bytes) -> int:
+    # never 0, that means "doesn't exist"
+    return int.from_bytes(hashlib.blake2b(content, digest_size=8).digest(), "big") or 1
+
+
+_store: Optional[ConfigStore] = None
+_store_lock = threading.Lock()
+
+
+def make_config_store(kind: str = None, directory: Path = None) -> ConfigStore:
+    """Create a store of the given kind, defaults come from FDS_CONFIG_STORE and FDS_CONFIG_DIR."""
+    kind = kind or os.environ.get("FDS_CONFIG_STORE", "vault")
+    if kind == "vault":
+        return VaultConfigStore()
+    if kind == "file":
+        directory = directory or Path(os.environ.get("FDS_CONFIG_DIR", root_config.known_location / "config"))
+        return FileConfigStore(directory)
+    raise ValueError(f"Unknown config store: {kind}, expected vault or file")
+
+
+def get_config_store() -> ConfigStore:
+    """Return the process wide config store, created on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = make_config_store()
+    return _store
+
+
+def set_config_store(store: ConfigStore) -> None:
+    """Replace the process wide config store, e.g. to run against a file store."""
+    global _store
+    with _store_lock:
+        _store = store
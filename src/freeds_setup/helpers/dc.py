@@ -1,28 +1,246 @@
 from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import json
+import threading
+import time
 import typing
 import os
 import subprocess
 from freeds_setup.helpers.flog import logger
+from freeds_setup.helpers import readiness
+from freeds_setup.helpers.files import atomic_write
+from freeds_setup.helpers.root_config import root_config
 from freeds_setup.importing.plugin_config import PluginConfig
 
+# plugin name -> fingerprint of the env file last written by this process
+_env_file_fingerprints: dict[str, str] = {}
 
-def execute_dc(params: typing.List[str], work_path: Path, env:dict) -> None:
+# background image pulls, plugin name -> pull, start_plugin waits for the pull of its plugin
+_pulls: dict[str, Future] = {}
+_pull_lock = threading.Lock()
+
+
+def execute_dc(
+    params: typing.List[str],
+    work_path: Path,
+    env: dict = None,
+    env_files: typing.List[Path] = None,
+    check: bool = False,
+) -> None:
+    """Run docker-compose in work_path.
+    Plugin env is either passed as env (replacing the environment) or read by compose from env_files.
+    A failing command is printed, with check the error is raised as well."""
     if not (work_path / "docker-compose.yaml").exists():
         raise FileNotFoundError(f"docker-compose.yaml not found in {Path.cwd()}")
     try:
-        dc = ["docker-compose", *params]
+        dc = ["docker-compose"]
+        for env_file in env_files or []:
+            dc += ["--env-file", str(env_file)]
+        dc += params
         logger.info(f"Executing: {dc}")
-        full_env = env.copy()
-        full_env['PATH'] =  os.environ.get('PATH')
+        if env is not None:
+            full_env = env.copy()
+            full_env['PATH'] =  os.environ.get('PATH')
+        else:
+            full_env = compose_environment(env_files)
         subprocess.run(args=dc, cwd=work_path, check=True, env=full_env)
     except subprocess.CalledProcessError as e:
         print(f"Docker compose command failed: {e}.")
+        if check:
+            raise
+
+
+def _env_file_keys(path: Path) -> set[str]:
+    keys = set()
+    try:
+        lines = path.read_text().splitlines()
+    except FileNotFoundError:
+        return keys
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#") and "=" in line:
+            keys.add(line.split("=", 1)[0].strip().removeprefix("export ").strip())
+    return keys
+
+
+def compose_environment(env_files: typing.Iterable[Path] = (), plugin_env: dict = None) -> dict:
+    """The process environment for docker compose.
+    Compose prefers shell variables over env files, so the shell's FDS_ variables (root config, leftovers of set_env)
+    and the variables the env files define are left out, the plugin env stays authoritative like it was when it
+    was the whole environment. plugin_env is added on top, for calls that pass the plugin env without env files."""
+    dropped = set()
+    for env_file in env_files or ():
+        dropped |= _env_file_keys(Path(env_file))
+    env = {k: v for k, v in os.environ.items() if not k.startswith("FDS_") and k not in dropped}
+    env.update(plugin_env or {})
+    return env
+
+
+def env_file_path(plugin: str) -> Path:
+    return root_config.known_location / "env" / f"{plugin}.env"
+
+
+def _quote_env_value(value: str) -> str:
+    """Quote a value for a compose env file, single quotes are taken literally (no $ interpolation)."""
+    if "'" not in value and "\n" not in value:
+        return f"'{value}'"
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("$", "\\$").replace("\n", "\\n")
+    return f'"{escaped}"'
+
+
+def materialize_env(plugin_config: PluginConfig) -> Path:
+    """Write the plugin's FDS_<PLUGIN>_<KEY> env to its env file under ~/.freeds/env, returns the file path.
+    The file starts with a fingerprint of the config and is only rewritten when the config changed."""
+    path = env_file_path(plugin_config.name)
+    fingerprint = hashlib.blake2b(
+        json.dumps(plugin_config.config, sort_keys=True, default=str).encode(), digest_size=16
+    ).hexdigest()
+    header = f"# fingerprint: {fingerprint}\n"
+    if _env_file_fingerprints.get(plugin_config.name) == fingerprint and path.exists():
+        return path
+    try:
+        with open(path, "r") as f:
+            if f.readline() == header:
+                _env_file_fingerprints[plugin_config.name] = fingerprint
+                return path
+    except FileNotFoundError:
+        pass
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lines = [header] + [f"{key}={_quote_env_value(value)}\n" for key, value in plugin_config.get_env().items()]
+    atomic_write(path, "".join(lines), mode=0o600)
+    _env_file_fingerprints[plugin_config.name] = fingerprint
+    logger.debug(f"Wrote env file {path}")
+    return path
+
+
+def plugin_env_files(plugin_config: PluginConfig) -> typing.List[Path]:
+    """Env files for compose, --env-file replaces the default .env so the plugin's own .env is passed first."""
+    env_files = []
+    dot_env = plugin_config.path / ".env"
+    if dot_env.exists():
+        env_files.append(dot_env)
+    env_files.append(materialize_env(plugin_config))
+    return env_files
+
+
+def compose_ps(plugin_config: PluginConfig, timeout: float = None) -> typing.List[dict]:
+    """Containers of the plugin's compose project, as reported by docker compose ps in json, one dict per container.
+    Read only, the plugin env is passed in the process environment (compose reads the plugin's .env itself),
+    nothing is written to the env files. Variables resolve as for up, see compose_environment."""
+    dc = ["docker-compose", "ps", "--all", "--format", "json"]
+    result = subprocess.run(
+        args=dc,
+        cwd=plugin_config.path,
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=timeout,
+        env=compose_environment([plugin_config.path / ".env"], plugin_config.get_env()),
+    )
+    output = result.stdout.strip()
+    if not output:
+        return []
+    # older compose versions print one json array, newer ones one object per line
+    if output.startswith("["):
+        return json.loads(output)
+    return [json.loads(line) for line in output.splitlines() if line.strip()]
+
+
+def containers_ready(containers: typing.List[dict]) -> bool:
+    """True when every container runs and is healthy (if it has a healthcheck), one-shot containers may have exited with 0."""
+    if not containers:
+        return False
+    for container in containers:
+        state = container.get("State", "")
+        if state == "exited" and container.get("ExitCode") == 0:
+            continue
+        if state != "running" or container.get("Health", "") not in ("", "healthy"):
+            return False
+    return True
+
+
+def wait_for_compose_health(plugin_config: PluginConfig, deadline: float = 60.0) -> float:
+    """Wait until the plugin's containers are running and healthy, returns seconds waited."""
+    return readiness.wait_until(
+        lambda: containers_ready(compose_ps(plugin_config)), f"containers of {plugin_config.name}", deadline=deadline
+    )
+
+
+def wait_for_plugin(plugin_config: PluginConfig, deadline: float = 60.0) -> float:
+    """Wait until a started plugin is ready, returns seconds waited.
+    Vault is ready when sys/health answers, other plugins when all their declared ports accept connections."""
+    if plugin_config.name == "vault":
+        return readiness.wait_for_vault(deadline=deadline)
+    ports = plugin_config.ports
+    if not ports:
+        logger.info(f"Plugin {plugin_config.name} declares no ports, not waiting for it.")
+        return 0.0
+    return readiness.wait_for_ports(ports, what=f"plugin {plugin_config.name}", deadline=deadline)
+
+
+def _pull(work_path: Path, env_files: typing.List[Path]) -> None:
+    dc = ["docker-compose"]
+    for env_file in env_files:
+        dc += ["--env-file", str(env_file)]
+    dc += ["pull", "--quiet", "--ignore-pull-failures"]
+    subprocess.run(
+        args=dc, cwd=work_path, env=compose_environment(env_files), check=True, capture_output=True, text=True
+    )
+
+
+def pull_in_background(plugin_configs: typing.Iterable[PluginConfig], max_parallel: int = 3) -> None:
+    """Start pulling the images of the plugins, max_parallel pulls at a time, while they are provisioned.
+    Each call has its own pool, so max_parallel applies per import run. start_plugin waits for the pull of its own plugin."""
+    with _pull_lock:
+        executor = ThreadPoolExecutor(max_workers=max(1, max_parallel), thread_name_prefix="pull")
+        for plugin_config in plugin_configs:
+            if not (plugin_config.path / "docker-compose.yaml").exists():
+                continue
+            running = _pulls.get(plugin_config.name)
+            if running and not running.done():
+                continue
+            # the same env files as up, so image tags resolve the same, written now with the config before provisioning
+            env_files = plugin_env_files(plugin_config)
+            _pulls[plugin_config.name] = executor.submit(_pull, plugin_config.path, env_files)
+        # the queued pulls still run, the threads end when they are done
+        executor.shutdown(wait=False)
+
+
+def wait_for_pull(plugin: str) -> None:
+    """Wait for the background pull of a plugin, if there is one. A failed pull is logged, up pulls again."""
+    with _pull_lock:
+        pull = _pulls.pop(plugin, None)
+    if pull is None:
+        return
+    start = time.monotonic()
+    try:
+        pull.result()
+    except subprocess.CalledProcessError as e:
+        logger.warning(f"Pulling images for {plugin} failed: {(e.stderr or '').strip()}")
+    except Exception as e:
+        logger.warning(f"Pulling images for {plugin} failed: {e}")
+    waited = time.monotonic() - start
+    if waited > 0.1:
+        logger.info(f"Waited {waited:.2f}s for the images of {plugin}")
+
+
+def cancel_pulls() -> None:
+    """Drop the pulls that haven't started, e.g. when an import failed."""
+    with _pull_lock:
+        for pull in _pulls.values():
+            pull.cancel()
+        _pulls.clear()
 
 
-def start_plugin(plugin_config: PluginConfig) -> None:
-    execute_dc(["up", "-d"], work_path=plugin_config.path, env = plugin_config.get_env())
+def start_plugin(plugin_config: PluginConfig, wait: bool = False, deadline: float = 60.0) -> None:
+    """Start the plugin with docker compose, optionally wait for it to be ready. Raises if docker compose fails."""
+    wait_for_pull(plugin_config.name)
+    execute_dc(["up", "-d"], work_path=plugin_config.path, env_files=plugin_env_files(plugin_config), check=True)
+    if wait:
+        wait_for_plugin(plugin_config, deadline=deadline)
 
 
 def stop_plugin(plugin_config: PluginConfig) -> None:
-    plugin_config.set_env()
-    execute_dc(["down"], work_path=plugin_config.path, env = plugin_config.get_env())
+    execute_dc(["down"], work_path=plugin_config.path, env_files=plugin_env_files(plugin_config))
@@ -0,0 +1,22 @@
+"""File helpers."""
+
+import os
+import threading
+from pathlib import Path
+
+
+def atomic_write(path: Path, data: str | bytes, mode: int = 0o644) -> None:
+    """Write data to path through a temp file in the same folder that is renamed over path,
+    so readers see the old or the new content and never a partial file.
+    The temp name is unique per process and thread, concurrent writers don't clobber each other's temp file.
+    mode is the permission of the written file, use 0o600 for anything holding secrets."""
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data.encode() if isinstance(data, str) else data)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
@@ -1,9 +1,8 @@
 import git
-import time
 from freeds_setup.helpers.flog import logger
 from pathlib import Path
 from freeds_setup.helpers.root_config import root_config
-from freeds_setup.helpers.bao_client import BaoClient
+from freeds_setup.helpers.bao_client import get_bao_client
 from freeds_setup.helpers.dc import start_plugin
 import freeds_setup.importing.plugin_import as plugin_import
 from  freeds_setup.importing.plugin_config import PluginConfig
@@ -30,11 +29,10 @@ def init_vault():
     plugin_config = PluginConfig(vault_dir)
     plugin_import.provision_all(plugin_config)
     logger.start("Starting vault")
-    start_plugin(plugin_config=plugin_config)
-    time.sleep(2)
+    start_plugin(plugin_config=plugin_config, wait=True)
     logger.succeed()
 
-    bao = BaoClient()
+    bao = get_bao_client()
     bao.retrieve_tokens_from_logs()
     bao.initialize()
     plugin_config.save_to_vault()
@@ -84,7 +82,7 @@ def setup_root_dir() -> None:
 
 if __name__ == "__main__":
     init_vault()
-    baox = BaoClient()
+    baox = get_bao_client()
     baox.retrieve_tokens_from_logs()
     import pyperclip
     pyperclip.copy(baox.root_token)
@@ -0,0 +1,90 @@
+"""Wait for services to come up, polling with exponential backoff and jitter instead of fixed sleeps."""
+
+import random
+import socket
+import time
+from typing import Callable, Iterable
+import requests
+from freeds_setup.helpers.flog import logger
+from freeds_setup.helpers.bao_client import BaoPaths
+
+
+def wait_until(
+    check: Callable[[], bool],
+    what: str,
+    deadline: float = 60.0,
+    initial_delay: float = 0.05,
+    max_delay: float = 2.0,
+) -> float:
+    """Call check until it returns True, returns the number of seconds it took.
+    The delay between attempts doubles up to max_delay, each delay is jittered to avoid polling in lockstep.
+    Exceptions from check count as not ready. Raises TimeoutError when deadline seconds have passed."""
+    start = time.monotonic()
+    delay = initial_delay
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            if check():
+                elapsed = time.monotonic() - start
+                logger.info(f"{what} ready after {elapsed:.2f}s ({attempts} attempts)")
+                return elapsed
+        except Exception as e:
+            logger.debug(f"{what} not ready: {e}")
+        remaining = deadline - (time.monotonic() - start)
+        if remaining <= 0:
+            raise TimeoutError(f"{what} not ready after {deadline}s ({attempts} attempts)")
+        time.sleep(min(random.uniform(delay / 2, delay), remaining))
+        delay = min(delay * 2, max_delay)
+
+
+def tcp_check(host: str, port: int, timeout: float = 1.0) -> Callable[[], bool]:
+    """Return a check that succeeds when a tcp connection to host:port can be opened."""
+
+    def check() -> bool:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+
+    return check
+
+
+def http_check(url: str, ok_codes: Iterable[int] = (200,), timeout: float = 1.0) -> Callable[[], bool]:
+    """Return a check that succeeds when url responds with one of ok_codes."""
+    ok_codes = set(ok_codes)
+
+    def check() -> bool:
+        return requests.get(url, timeout=timeout).status_code in ok_codes
+
+    return check
+
+
+def all_checks(checks: list[Callable[[], bool]]) -> Callable[[], bool]:
+    """Combine checks, passed checks are not repeated on later attempts."""
+    pending = list(checks)
+
+    def check() -> bool:
+        while pending:
+            if not pending[0]():
+                return False
+            pending.pop(0)
+        return True
+
+    return check
+
+
+# sys/health codes of a vault that is initialized and unsealed: active (200), standby (429) and performance standby (473).
+# 501 (not initialized), 503 (sealed) and 472 (dr secondary) answer but can't serve config reads and writes,
+# the vault plugin initializes and auto-unseals itself to get out of those.
+VAULT_USABLE_CODES = (200, 429, 473)
+
+
+def wait_for_vault(deadline: float = 60.0) -> float:
+    """Wait until vault is initialized and unsealed, see VAULT_USABLE_CODES, returns seconds waited."""
+    url = f"{BaoPaths().v1_path}/sys/health"
+    return wait_until(http_check(url, VAULT_USABLE_CODES), "vault", deadline=deadline)
+
+
+def wait_for_ports(ports: Iterable[int], what: str, host: str = "127.0.0.1", deadline: float = 60.0) -> float:
+    """Wait for tcp ports to accept connections, returns seconds waited."""
+    checks = [tcp_check(host, port) for port in ports]
+    return wait_until(all_checks(checks), what, deadline=deadline)
@@ -0,0 +1,132 @@
+"""Client side protection for a small vault server: adaptive concurrency limit, circuit breaker and retry backoff."""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit.
+    Every good response raises the limit by 1/limit, i.e. by one per limit responses.
+    An overloaded response (429/5xx, connection error or latency far above the best seen) halves it,
+    at most once per baseline latency so a burst of failures from the same overload only counts once.
+    """
+
+    def __init__(
+        self,
+        initial: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        latency_tolerance: float = 3.0,
+        min_latency_floor: float = 0.05,
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        # a response is slow when it takes longer than tolerance * baseline, and longer than the floor,
+        # so sub-millisecond jitter on localhost doesn't count as overload
+        self.latency_tolerance = latency_tolerance
+        self.min_latency_floor = min_latency_floor
+        self.baseline: Optional[float] = None
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Hold one of the limited slots while a request is in flight."""
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify()
+
+    def record(self, latency: float, overloaded: bool = False) -> None:
+        """Adjust the limit from the outcome of a request."""
+        with self._cond:
+            if not overloaded:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    # let the baseline follow a server that got slower for good
+                    self.baseline += (latency - self.baseline) * 0.01
+                threshold = max(self.baseline * self.latency_tolerance, self.min_latency_floor)
+                overloaded = latency > threshold
+
+            now = time.monotonic()
+            if overloaded:
+                if now - self._last_decrease > (self.baseline or 0.0):
+                    self.limit = max(float(self.min_limit), self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+                self._cond.notify_all()
+
+
+class CircuitBreaker:
+    """Fail fast while the server is down.
+    After failure_threshold consecutive failures the circuit opens and requests are refused for reset_timeout
+    seconds, then a single trial request is let through (half open), its outcome closes or re-opens the circuit.
+    A trial whose outcome is never reported doesn't block the circuit, another one is let through after reset_timeout.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """True if a request may be sent now."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open" and now - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_at = now
+                return True
+            if self.state == "half_open" and now - self._trial_at >= self.reset_timeout:
+                self._trial_at = now
+                return True
+            return False
+
+    def success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    @property
+    def retry_in(self) -> float:
+        """Seconds until the next trial request is allowed."""
+        return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+
+def backoff_delay(attempt: int, base: float = 0.1, cap: float = 5.0) -> float:
+    """Exponential backoff with full jitter for the given (zero based) retry attempt."""
+    return random.uniform(0, min(cap, base * 2**attempt))
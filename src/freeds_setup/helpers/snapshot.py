@@ -0,0 +1,57 @@
+"""Export and import the config of all plugins as one file.
+The file is JSON lines, one plugin per line: {"plugin": <name>, "data": <config>}.
+A .gz suffix makes it gzip compressed."""
+
+import gzip
+import json
+from pathlib import Path
+from typing import IO
+from freeds_setup.helpers.config_store import get_config_store
+from freeds_setup.helpers.flog import logger
+from freeds_setup.helpers.files import atomic_write
+
+
+def _open(path: Path, mode: str, compressed: bool) -> IO[str]:
+    if compressed:
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def export_snapshot(path: Path) -> int:
+    """Write all plugin configs to a snapshot file, returns the number of plugins exported."""
+    configs = get_config_store().read_all()
+    configs = {plugin: data for plugin, data in configs.items() if data}
+    content = "".join(
+        json.dumps({"plugin": plugin, "data": data}, separators=(",", ":")) + "\n"
+        for plugin, data in sorted(configs.items())
+    ).encode("utf-8")
+    if path.suffix == ".gz":
+        content = gzip.compress(content)
+    # the snapshot holds passwords
+    atomic_write(path, content, mode=0o600)
+    logger.info(f"Exported {len(configs)} plugins to {path}")
+    return len(configs)
+
+
+def read_snapshot(path: Path) -> dict[str, dict]:
+    """Read a snapshot file into a dict of plugin name -> config."""
+    configs = {}
+    with _open(path, "r", compressed=path.suffix == ".gz") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                configs[entry["plugin"]] = entry["data"]
+            except (ValueError, KeyError) as e:
+                raise ValueError(f"Invalid snapshot entry at {path}:{line_no}: {e}") from e
+    return configs
+
+
+def import_snapshot(path: Path) -> int:
+    """Write all plugin configs from a snapshot file to the config store, returns the number of plugins imported.
+    Top level keys from the snapshot replace the stored ones, plugins not in the snapshot are left alone."""
+    configs = read_snapshot(path)
+    get_config_store().write_many(configs)
+    logger.info(f"Imported {len(configs)} plugins from {path}")
+    return len(configs)
@@ -0,0 +1,90 @@
+"""Start and stop the whole stack.
+Plugins are started in dependency waves: a wave holds the plugins whose dependencies are all in earlier waves,
+the compose projects of a wave are started concurrently and the next wave starts when all of them are ready
+(declared ports open and containers running/healthy). Stopping runs the waves in reverse.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from graphlib import TopologicalSorter
+from typing import Callable, Iterable
+from freeds_setup.helpers import dc
+from freeds_setup.helpers.flog import logger
+from freeds_setup.importing.plugin_config import PluginConfig, get_all_plugins
+
+
+def dependency_waves(plugin_configs: Iterable[PluginConfig]) -> list[list[PluginConfig]]:
+    """Group plugins in waves, vault is always a wave of its own first.
+    Dependencies on plugins that aren't in plugin_configs are ignored."""
+    by_name = {p.name: p for p in plugin_configs}
+    waves = []
+    vault = by_name.pop("vault", None)
+    if vault:
+        waves.append([vault])
+    ts = TopologicalSorter({name: [d for d in p.dependencies if d in by_name] for name, p in by_name.items()})
+    ts.prepare()
+    while ts.is_active():
+        ready = sorted(ts.get_ready())
+        waves.append([by_name[name] for name in ready])
+        ts.done(*ready)
+    return waves
+
+
+def compose_plugins(plugin_configs: Iterable[PluginConfig] = None) -> list[PluginConfig]:
+    """The plugins that have a compose file, default all plugins in the config store."""
+    if plugin_configs is None:
+        plugin_configs = get_all_plugins()
+    result = []
+    for plugin_config in plugin_configs:
+        path = plugin_config.config.get("plugin_path")
+        if not path or not (plugin_config.path / "docker-compose.yaml").exists():
+            logger.debug(f"Plugin {plugin_config.name} has no compose file, skipped.")
+            continue
+        result.append(plugin_config)
+    return result
+
+
+def _run_waves(
+    waves: list[list[PluginConfig]], action: Callable[[PluginConfig], None], what: str, max_parallel: int
+) -> None:
+    """Run action for every plugin of a wave concurrently, a wave must complete before the next one starts."""
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel), thread_name_prefix=what) as pool:
+        for number, wave in enumerate(waves, start=1):
+            started = time.monotonic()
+            futures = {p.name: pool.submit(action, p) for p in wave}
+            errors = []
+            for name, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"{what} {name} failed: {e}")
+                    errors.append(e)
+            if errors:
+                raise errors[0]
+            logger.progress(
+                f"Wave {number}/{len(waves)} {[p.name for p in wave]} done in {time.monotonic() - started:.2f}s"
+            )
+
+
+def start_and_wait(plugin_config: PluginConfig, deadline: float = 120.0) -> None:
+    """Start a plugin and wait until its ports accept connections and its containers are healthy."""
+    dc.start_plugin(plugin_config)
+    start = time.monotonic()
+    dc.wait_for_plugin(plugin_config, deadline=deadline)
+    dc.wait_for_compose_health(plugin_config, deadline=max(1.0, deadline - (time.monotonic() - start)))
+
+
+def stack_up(plugin_configs: Iterable[PluginConfig] = None, max_parallel: int = 8, deadline: float = 120.0) -> None:
+    """Start the plugins (default all) in dependency waves, deadline is the max wait per plugin."""
+    waves = dependency_waves(compose_plugins(plugin_configs))
+    logger.commence(f"Starting {sum(len(w) for w in waves)} plugins in {len(waves)} waves")
+    _run_waves(waves, lambda p: start_and_wait(p, deadline=deadline), "start", max_parallel)
+    logger.complete()
+
+
+def stack_down(plugin_configs: Iterable[PluginConfig] = None, max_parallel: int = 8) -> None:
+    """Stop the plugins (default all), dependents before their dependencies."""
+    waves = list(reversed(dependency_waves(compose_plugins(plugin_configs))))
+    logger.commence(f"Stopping {sum(len(w) for w in waves)} plugins in {len(waves)} waves")
+    _run_waves(waves, dc.stop_plugin, "stop", max_parallel)
+    logger.complete()
@@ -0,0 +1,177 @@
+"""Health of the stack in one pass: vault health, compose container state, declared ports and ui uris.
+All probes run concurrently and share one time budget, so a status takes about as long as the slowest probe."""
+
+import socket
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable
+import requests
+from freeds_setup.helpers import dc, readiness
+from freeds_setup.helpers.bao_client import BaoPaths
+from freeds_setup.helpers.flog import logger
+from freeds_setup.helpers.stack import compose_plugins
+from freeds_setup.importing.plugin_config import PluginConfig, get_all_plugins
+
+VAULT_STATES = {
+    200: "active",
+    429: "standby",
+    472: "dr secondary",
+    473: "performance standby",
+    501: "not initialized",
+    503: "sealed",
+}
+
+
+class Budget:
+    """Shared deadline of all probes."""
+
+    def __init__(self, timeout: float):
+        self.deadline = time.monotonic() + timeout
+
+    @property
+    def remaining(self) -> float:
+        # never 0, a probe that starts at the deadline still gets a chance to fail fast
+        return max(0.05, self.deadline - time.monotonic())
+
+
+def probe_vault(budget: Budget) -> tuple[bool, str]:
+    response = requests.get(f"{BaoPaths().v1_path}/sys/health", timeout=budget.remaining)
+    state = VAULT_STATES.get(response.status_code, f"http {response.status_code}")
+    return response.status_code in readiness.VAULT_USABLE_CODES, state
+
+
+def probe_containers(plugin_config: PluginConfig, budget: Budget) -> tuple[bool, str]:
+    containers = dc.compose_ps(plugin_config, timeout=budget.remaining)
+    if not containers:
+        return False, "not running"
+    ready = sum(1 for c in containers if dc.containers_ready([c]))
+    unhealthy = [c.get("Service") or c.get("Name") for c in containers if not dc.containers_ready([c])]
+    detail = f"{ready}/{len(containers)} ready"
+    if unhealthy:
+        detail += f" ({', '.join(map(str, unhealthy))} not)"
+    return ready == len(containers), detail
+
+
+def probe_port(port: int, budget: Budget, host: str = "127.0.0.1") -> tuple[bool, str]:
+    try:
+        with socket.create_connection((host, port), timeout=budget.remaining):
+            return True, "open"
+    except OSError:
+        return False, "closed"
+
+
+def probe_uri(uri: str, budget: Budget) -> tuple[bool, str]:
+    """Any http response counts as up, a login page answering 401 is a running ui."""
+    response = requests.get(uri, timeout=budget.remaining, allow_redirects=False)
+    return response.status_code < 500, str(response.status_code)
+
+
+def ui_uris(plugin_config: PluginConfig) -> list[str]:
+    """The uris set by the plugin's Ui resources, ui_uri or ui_uri_<name>."""
+    return [
+        str(value)
+        for key, value in plugin_config.config.items()
+        if (key == "ui_uri" or key.startswith("ui_uri_")) and str(value).startswith(("http://", "https://"))
+    ]
+
+
+def _result(future: Future) -> tuple[bool, str]:
+    if not future.done():
+        future.cancel()
+        return False, "timeout"
+    try:
+        return future.result()
+    except requests.Timeout:
+        return False, "timeout"
+    except requests.ConnectionError:
+        return False, "unreachable"
+    except Exception as e:
+        return False, str(e).splitlines()[0] if str(e) else type(e).__name__
+
+
+def _load_plugins(budget: Budget) -> tuple[list[PluginConfig], str]:
+    """Load the plugin configs within the budget, returns the configs and an error message (None if they loaded).
+    The load runs in a daemon thread, a config store that doesn't answer can't hold up the status or the exit."""
+    result = {}
+
+    def load() -> None:
+        try:
+            result["plugins"] = get_all_plugins()
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=load, name="status-config", daemon=True)
+    thread.start()
+    thread.join(timeout=max(0.0, budget.deadline - time.monotonic()))
+    if "plugins" in result:
+        return result["plugins"], None
+    if "error" in result:
+        logger.debug(f"Loading plugin configs failed: {result['error']}")
+        return [], f"Plugin configs could not be loaded: {result['error']}"
+    return [], "Plugin configs could not be loaded: timeout"
+
+
+def collect_status(timeout: float = 3.0, max_workers: int = 32) -> dict:
+    """Probe everything concurrently within timeout seconds, returns
+    {"ok", "vault": {"ok", "state"}, "plugins": {name: {"ok", "containers", "ports", "ui"}}, "error"}."""
+    budget = Budget(timeout)
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="status")
+    futures: list[Future] = []
+
+    def submit(probe: Callable, *args) -> Future:
+        future = pool.submit(probe, *args, budget)
+        futures.append(future)
+        return future
+
+    # vault is probed while the plugin configs are loaded
+    vault = submit(probe_vault)
+    plugin_configs, error = _load_plugins(budget)
+
+    # config-only plugins have no containers to probe, same as for up/down
+    with_compose = {p.name for p in compose_plugins(plugin_configs)}
+    probes = {}
+    for plugin_config in plugin_configs:
+        probes[plugin_config.name] = {
+            "containers": submit(probe_containers, plugin_config) if plugin_config.name in with_compose else None,
+            "ports": {port: submit(probe_port, port) for port in plugin_config.ports},
+            "ui": {uri: submit(probe_uri, uri) for uri in ui_uris(plugin_config)},
+        }
+
+    wait(futures, timeout=max(0.0, budget.deadline - time.monotonic()))
+    # don't wait for probes that ran over, their results are reported as timeout
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    vault_ok, vault_state = _result(vault)
+    status = {"ok": vault_ok and not error, "vault": {"ok": vault_ok, "state": vault_state}, "plugins": {}}
+    if error:
+        status["error"] = error
+    for name, plugin_probes in probes.items():
+        plugin = {"ok": True, "containers": None, "ports": {}, "ui": {}}
+        if plugin_probes["containers"]:
+            ok, detail = _result(plugin_probes["containers"])
+            plugin["containers"] = detail
+            plugin["ok"] &= ok
+        for kind in ("ports", "ui"):
+            for target, future in plugin_probes[kind].items():
+                ok, detail = _result(future)
+                plugin[kind][str(target)] = detail
+                plugin["ok"] &= ok
+        status["plugins"][name] = plugin
+        status["ok"] &= plugin["ok"]
+    return status
+
+
+def format_table(status: dict) -> str:
+    """Status as a plain text table."""
+    rows = [("PLUGIN", "STATUS", "CONTAINERS", "PORTS", "UI")]
+    rows.append(("vault (server)", "ok" if status["vault"]["ok"] else "FAIL", status["vault"]["state"], "", ""))
+    for name, plugin in sorted(status["plugins"].items()):
+        ports = " ".join(f"{port}:{state}" for port, state in plugin["ports"].items())
+        ui = " ".join(f"{uri} {state}" for uri, state in plugin["ui"].items())
+        rows.append((name, "ok" if plugin["ok"] else "FAIL", plugin["containers"] or "-", ports or "-", ui or "-"))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]) - 1)]
+    lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)) + "  " + row[-1] for row in rows]
+    if status.get("error"):
+        lines.append(status["error"])
+    return "\n".join(line.rstrip() for line in lines)
@@ -0,0 +1,116 @@
+"""Parsed yaml cache.
+Files are parsed with the libyaml C loader when pyyaml was built with it. The parsed result is cached in memory
+and pickled under ~/.freeds/cache/yaml, keyed on path and validated against mtime, size and a content hash,
+so unchanged files are never parsed twice. There is one pickle per path, the folder is capped at max_files
+by dropping the least recently used pickles, which also clears out files of plugins that were moved or removed.
+"""
+
+import hashlib
+import os
+import pickle
+import threading
+from pathlib import Path
+from typing import Any, Optional
+import yaml
+from freeds_setup.helpers.flog import logger
+from freeds_setup.helpers.files import atomic_write
+from freeds_setup.helpers.root_config import root_config
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+class YamlCache:
+    def __init__(self, cache_dir: Optional[Path] = None, max_files: int = 2000):
+        self.cache_dir = cache_dir
+        self.max_files = max_files
+        # path -> (mtime_ns, size, content hash, pickled data), the data is pickled so every hit returns a fresh copy
+        self._entries: dict[str, tuple[int, int, str, bytes]] = {}
+        self._lock = threading.Lock()
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self._prune()
+
+    def _prune(self) -> None:
+        """Remove the least recently used pickles above max_files, a disk hit touches its pickle."""
+        try:
+            files = [(f.stat().st_mtime_ns, f.path) for f in os.scandir(self.cache_dir) if f.name.endswith(".pickle")]
+        except OSError as e:
+            logger.warning(f"Failed to list yaml cache {self.cache_dir}: {e}")
+            return
+        if len(files) <= self.max_files:
+            return
+        files.sort()
+        for _, path in files[: len(files) - self.max_files]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        logger.debug(f"Pruned {len(files) - self.max_files} files from yaml cache {self.cache_dir}")
+
+    def _file(self, key: str) -> Path:
+        return self.cache_dir / (hashlib.sha1(key.encode()).hexdigest() + ".pickle")
+
+    def _get_entry(self, key: str) -> Optional[tuple[int, int, str, bytes]]:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry or not self.cache_dir:
+            return entry
+        file = self._file(key)
+        try:
+            with open(file, "rb") as f:
+                entry = pickle.load(f)
+            # keep it off the prune list
+            os.utime(file)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def _put_entry(self, key: str, entry: tuple[int, int, str, bytes]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+        if not self.cache_dir:
+            return
+        try:
+            atomic_write(self._file(key), pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL))
+        except OSError as e:
+            logger.warning(f"Failed to write yaml cache for {key}: {e}")
+
+    def load(self, path: Path) -> Any:
+        """Return the parsed content of a yaml file, from cache when the file is unchanged."""
+        key = str(Path(path).resolve())
+        st = os.stat(key)
+        entry = self._get_entry(key)
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return pickle.loads(entry[3])
+
+        with open(key, "rb") as f:
+            content = f.read()
+        digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+        if entry and entry[2] == digest:
+            # touched but not changed, keep the parsed data and remember the new mtime
+            self._put_entry(key, (st.st_mtime_ns, st.st_size, digest, entry[3]))
+            return pickle.loads(entry[3])
+
+        data = yaml.load(content, Loader=SafeLoader)
+        self._put_entry(key, (st.st_mtime_ns, st.st_size, digest, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)))
+        return data
+
+
+_cache: Optional[YamlCache] = None
+_cache_lock = threading.Lock()
+
+
+def load_yaml(path: Path) -> Any:
+    """Load a yaml file through the process wide cache, FDS_YAML_CACHE=0 disables the disk part."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                use_disk = os.environ.get("FDS_YAML_CACHE", "1") != "0"
+                _cache = YamlCache(root_config.known_location / "cache" / "yaml" if use_disk else None)
+    return _cache.load(path)
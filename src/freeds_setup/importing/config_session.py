@@ -0,0 +1,93 @@
+import copy
+import threading
+from typing import TYPE_CHECKING, Optional
+from freeds_setup.helpers.config_store import get_config_store
+from freeds_setup.helpers.flog import logger
+
+if TYPE_CHECKING:
+    from freeds_setup.importing.plugin_config import PluginConfig
+
+
+class ConfigSession:
+    """Unit of work for plugin config writes.
+    Staged plugin configs are kept in memory and written to the config store when the session is flushed,
+    either at an explicit checkpoint or when the session ends without an error, a session that ends with an error
+    discards what is staged since the last flush. Staging the same plugin again replaces
+    the earlier entry, so each plugin is written once per flush, and the flush writes all plugins concurrently.
+
+    While a session is active, save_to_vault stages instead of writing and PluginConfig(name) and
+    get_all_plugins see the staged configs.
+
+    with ConfigSession() as session:
+        provision_all(plugin_config)
+        session.stage(plugin_config)
+    """
+
+    def __init__(self):
+        self._pending: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._previous: Optional["ConfigSession"] = None
+
+    def stage(self, plugin_config: "PluginConfig") -> None:
+        """Stage a plugin config for writing, later changes to the plugin config are included in the write."""
+        with self._lock:
+            self._pending[plugin_config.name] = plugin_config.plugin_data
+
+    def get(self, plugin: str) -> Optional[dict]:
+        """Return a copy of the staged data for a plugin, None if it's not staged."""
+        with self._lock:
+            data = self._pending.get(plugin)
+            return copy.deepcopy(data) if data is not None else None
+
+    def pending(self) -> dict[str, dict]:
+        """Return a copy of all staged plugin data, plugin name -> data."""
+        with self._lock:
+            return copy.deepcopy(self._pending)
+
+    def __contains__(self, plugin: str) -> bool:
+        return plugin in self._pending
+
+    def flush(self) -> int:
+        """Write all staged configs to the config store, returns the number of plugins written."""
+        with self._lock:
+            pending = copy.deepcopy(self._pending)
+            self._pending.clear()
+        if not pending:
+            return 0
+        logger.info(f"Writing config for {len(pending)} plugins: {list(pending)}")
+        try:
+            get_config_store().write_many(pending)
+        except Exception:
+            # put back what wasn't superseded by new stages, a retry of flush will write it
+            with self._lock:
+                for plugin, data in pending.items():
+                    self._pending.setdefault(plugin, data)
+            raise
+        return len(pending)
+
+    def __enter__(self) -> "ConfigSession":
+        global _active_session
+        self._previous = _active_session
+        _active_session = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        global _active_session
+        _active_session = self._previous
+        if exc_type is None:
+            self.flush()
+            return
+        # a failed unit of work isn't written, half imported plugins would look imported on the next run
+        with self._lock:
+            discarded = list(self._pending)
+            self._pending.clear()
+        if discarded:
+            logger.warning(f"Import failed, staged config of {discarded} is not written.")
+
+
+_active_session: Optional[ConfigSession] = None
+
+
+def active_session() -> Optional[ConfigSession]:
+    """Return the session config writes currently go to, None if they go straight to the config store."""
+    return _active_session
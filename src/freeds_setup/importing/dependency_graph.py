@@ -0,0 +1,167 @@
+"""Index of plugin dependencies, kept in ~/.freeds/dependency_graph.json.
+Answers which plugins are affected when a plugin changes, without loading every plugin config."""
+
+import json
+from collections import deque
+from graphlib import TopologicalSorter
+from pathlib import Path
+from typing import Iterable
+from freeds_setup.helpers.flog import logger
+from freeds_setup.helpers.files import atomic_write
+from freeds_setup.helpers.root_config import root_config
+from freeds_setup.importing.plugin_config import PluginConfig, get_all_plugins
+
+
+class DependencyGraph:
+    """Plugin dependency graph with forward (plugin -> dependencies) and reverse (plugin -> dependents) edges."""
+
+    def __init__(self, dependencies: dict[str, Iterable[str]] = None, paths: dict[str, str] = None):
+        self.dependencies: dict[str, set[str]] = {}
+        self.dependents: dict[str, set[str]] = {}
+        # plugin -> plugin folder, so an affected plugin can be re-imported from source
+        self.paths: dict[str, str] = dict(paths or {})
+        for plugin, deps in (dependencies or {}).items():
+            self.set_dependencies(plugin, deps)
+
+    @classmethod
+    def from_plugins(cls, plugin_configs: Iterable[PluginConfig]) -> "DependencyGraph":
+        graph = cls()
+        graph.update(plugin_configs)
+        return graph
+
+    def set_dependencies(self, plugin: str, deps: Iterable[str]) -> None:
+        """Replace the dependencies of a plugin, keeping the reverse edges in step."""
+        for old in self.dependencies.get(plugin, set()):
+            self.dependents.get(old, set()).discard(plugin)
+        deps = set(deps)
+        self.dependencies[plugin] = deps
+        self.dependents.setdefault(plugin, set())
+        for dep in deps:
+            self.dependents.setdefault(dep, set()).add(plugin)
+
+    def update(self, plugin_configs: Iterable[PluginConfig]) -> None:
+        for plugin_config in plugin_configs:
+            self.set_dependencies(plugin_config.name, plugin_config.dependencies)
+            if "plugin_path" in plugin_config.config:
+                self.paths[plugin_config.name] = plugin_config.config["plugin_path"]
+
+    def affected_by(self, plugin: str) -> set[str]:
+        """The plugin itself and every plugin that depends on it, directly or indirectly."""
+        affected = {plugin}
+        queue = deque([plugin])
+        while queue:
+            for dependent in self.dependents.get(queue.popleft(), ()):
+                if dependent not in affected:
+                    affected.add(dependent)
+                    queue.append(dependent)
+        return affected
+
+    def order(self, plugins: Iterable[str]) -> list[str]:
+        """Sort a subset of plugins in dependency order."""
+        plugins = set(plugins)
+        ts = TopologicalSorter({p: self.dependencies.get(p, set()) & plugins for p in plugins})
+        return list(ts.static_order())
+
+    def cycles(self) -> list[list[str]]:
+        """Return the dependency cycles, each as the list of plugins in it (Tarjan's strongly connected components)."""
+        index: dict[str, int] = {}
+        low: dict[str, int] = {}
+        stack: list[str] = []
+        on_stack: set[str] = set()
+        cycles = []
+        counter = 0
+
+        def visit(root: str) -> None:
+            nonlocal counter
+            # iterative dfs, deep dependency chains must not hit the recursion limit
+            work = [(root, iter(sorted(self.dependencies.get(root, ()))))]
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, children = work[-1]
+                child = next(children, None)
+                if child is not None:
+                    if child not in index:
+                        index[child] = low[child] = counter
+                        counter += 1
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(sorted(self.dependencies.get(child, ())))))
+                    elif child in on_stack:
+                        low[node] = min(low[node], index[child])
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in self.dependencies.get(node, ()):
+                        cycles.append(sorted(component))
+
+        for plugin in sorted(self.dependencies):
+            if plugin not in index:
+                visit(plugin)
+        return cycles
+
+    def to_dict(self) -> dict:
+        return {
+            "dependencies": {p: sorted(d) for p, d in sorted(self.dependencies.items())},
+            "paths": self.paths,
+        }
+
+    def save(self, path: Path = None) -> None:
+        path = path or graph_file()
+        atomic_write(path, json.dumps(self.to_dict(), indent=2))
+
+    @classmethod
+    def load(cls, path: Path = None) -> "DependencyGraph":
+        with open(path or graph_file(), "r") as f:
+            data = json.load(f)
+        return cls(data.get("dependencies", {}), data.get("paths", {}))
+
+
+def graph_file() -> Path:
+    return root_config.known_location / "dependency_graph.json"
+
+
+def build_graph() -> DependencyGraph:
+    """Build the graph from all plugins in the config store and save it."""
+    graph = DependencyGraph.from_plugins(get_all_plugins())
+    report_cycles(graph)
+    graph.save()
+    return graph
+
+
+def load_graph() -> DependencyGraph:
+    """Load the saved graph, build it from the config store if there is none."""
+    try:
+        return DependencyGraph.load()
+    except (FileNotFoundError, ValueError):
+        return build_graph()
+
+
+def update_graph(plugin_configs: Iterable[PluginConfig]) -> None:
+    """Record the dependencies of (re)imported plugins in the saved graph."""
+    try:
+        graph = DependencyGraph.load()
+    except (FileNotFoundError, ValueError):
+        # no usable index yet, the store has the imported plugins already
+        build_graph()
+        return
+    graph.update(plugin_configs)
+    report_cycles(graph)
+    graph.save()
+
+
+def report_cycles(graph: DependencyGraph) -> None:
+    for cycle in graph.cycles():
+        logger.warning(f"Dependency cycle between plugins: {' -> '.join(cycle)}")
@@ -1,10 +1,13 @@
 from pathlib import Path
 from graphlib import TopologicalSorter
+import hashlib
+import json
 import os
-import yaml
 import typing
 import uuid
-from freeds_setup.helpers.bao_client import BaoClient
+from freeds_setup.helpers.config_store import get_config_store
+from freeds_setup.helpers.yaml_cache import load_yaml
+from freeds_setup.importing.config_session import active_session
 
 
 class PluginConfig:
@@ -12,15 +15,24 @@ class PluginConfig:
     Class to hold information about a plugin.
     """
 
-    def __init__(self, plugin: Path | str = None):
-        """Load plugin config, if Path is provided it is loaded from file else from vault."""
+    def __init__(self, plugin: Path | str = None, lazy: bool = False):
+        """Load plugin config, if Path is provided it is loaded from file else from the config store (vault).
+        With lazy=True nothing is read until the plugin data is first used, see also prefetch()."""
         if not plugin:
             plugin = os.environ.get('FDS_CURRENT_PLUGIN_NAME')
         if not plugin:
             raise ValueError(f'plugin name must be provided either as parameter or as env FDS_CURRENT_PLUGIN_NAME.')
 
+        self._source = plugin
+        self._plugin_data = None
+        if not lazy:
+            self._load()
+
+    def _load(self) -> None:
+        plugin = self._source
         if isinstance(plugin, Path):
             self.plugin_data = self._read_file(plugin.resolve())
+            self.meta["fingerprint"] = plugin_fingerprint(plugin)
             self.config["plugin_name"] = plugin.name
             self.config["plugin_path"] = str(plugin)
             if "plugin_id" not in self.config:
@@ -33,13 +45,46 @@ class PluginConfig:
             if p.exists():
                 self.meta["dc"] = str(p)
         else:
-            bao = BaoClient()
-            self.plugin_data = bao.read_plugin_config(plugin)
-            if not self.plugin_data:
-                raise ValueError(f'Plugin {plugin} not found in vault.')
+            session = active_session()
+            staged = session.get(plugin) if session else None
+            if staged is not None:
+                self.plugin_data = staged
+            else:
+                self._set_loaded(get_config_store().read(plugin))
+
+    def _set_loaded(self, plugin_data: dict) -> None:
+        if not plugin_data:
+            raise ValueError(f'Plugin {self._source} not found in the config store.')
+        self.plugin_data = plugin_data
+
+    @classmethod
+    def from_data(cls, plugin_data: dict) -> "PluginConfig":
+        """Create a plugin config from already loaded plugin data, e.g. a bulk read from vault."""
+        plugin_config = cls.__new__(cls)
+        plugin_config._source = None
+        plugin_config._plugin_data = plugin_data
+        return plugin_config
+
+    @property
+    def plugin_data(self) -> dict[str, typing.Any]:
+        """The plugin data, loaded on first access for lazy plugin configs."""
+        if self._plugin_data is None:
+            self._load()
+        return self._plugin_data
+
+    @plugin_data.setter
+    def plugin_data(self, plugin_data: dict[str, typing.Any]) -> None:
+        self._plugin_data = plugin_data
+
+    @property
+    def loaded(self) -> bool:
+        return self._plugin_data is not None
 
     @property
     def name(self):
+        # a lazy config knows its name without loading
+        if self._plugin_data is None:
+            return self._source.name if isinstance(self._source, Path) else self._source
         return self.config["plugin_name"]
 
     @property
@@ -52,10 +97,9 @@ class PluginConfig:
         """
         plugin_data_path = plugin / "plugin.yaml"
         if not plugin_data_path.exists():
-            raise FileNotFoundError(f"plugin.yaml not found in {self.path}")
+            raise FileNotFoundError(f"plugin.yaml not found in {plugin}")
 
-        with plugin_data_path.open("r") as f:
-            yaml_data = yaml.safe_load(f)
+        yaml_data = load_yaml(plugin_data_path)
         if not yaml_data:
             raise ValueError(f"No yaml found in: {plugin_data_path}")
         # Ensure the root element "plugin" exists
@@ -64,8 +108,12 @@ class PluginConfig:
         return yaml_data["plugin"]
 
     def save_to_vault(self):
-        bao = BaoClient()
-        bao.write_plugin_config(self.name, self.plugin_data)
+        """Write the config to the config store (vault), or stage it if a ConfigSession is active."""
+        session = active_session()
+        if session:
+            session.stage(self)
+            return
+        get_config_store().write(self.name, self.plugin_data)
 
     def _assert_dict(self, root_dict: str) -> dict[str, typing.Any]:
         """Create sub dict if needed and return it
@@ -118,6 +166,17 @@ class PluginConfig:
         return f"<PluginConfig {self.name}>"
 
 
+def plugin_fingerprint(plugin_folder: Path) -> str:
+    """Hash of the plugin folder path and the parsed plugin.yaml and docker-compose.yaml.
+    The yaml is hashed as sorted json, so formatting, comments and key order don't change the fingerprint."""
+    digest = hashlib.sha256(str(plugin_folder.resolve()).encode())
+    for name in ("plugin.yaml", "docker-compose.yaml"):
+        path = plugin_folder / name
+        data = load_yaml(path) if path.exists() else None
+        digest.update(b"\0" + json.dumps(data, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
 def sort_plugins(plugin_configs: list[PluginConfig]) -> list[PluginConfig]:
     """Sort plugins in dependency order, vault is always first."""
     plugin_configs = {p.name: p for p in plugin_configs}
@@ -128,13 +187,44 @@ def sort_plugins(plugin_configs: list[PluginConfig]) -> list[PluginConfig]:
     deps = {p.name: p.dependencies for p in plugin_configs.values()}
     ts = TopologicalSorter(deps)
     sorted_keys = list(ts.static_order())
-    sorted_plugin_configs = list(plugin_configs[name] for name in sorted_keys)
+    # dependencies on plugins that aren't in the list are in the order too, skip them
+    sorted_plugin_configs = list(plugin_configs[name] for name in sorted_keys if name in plugin_configs)
     if vault:
         sorted_plugin_configs.insert(0, vault)
     return sorted_plugin_configs
 
 
+def prefetch(plugin_configs: typing.Iterable[PluginConfig]) -> list[PluginConfig]:
+    """Load lazy plugin configs that aren't loaded yet, the store reads are done in one concurrent pass.
+    Returns the plugin configs that were not found, they stay unloaded."""
+    pending = [p for p in plugin_configs if not p.loaded]
+    session = active_session()
+    by_name = {}
+    for plugin_config in pending:
+        staged = session.get(plugin_config.name) if session else None
+        if staged is not None:
+            plugin_config.plugin_data = staged
+        elif isinstance(plugin_config._source, Path):
+            plugin_config._load()
+        else:
+            by_name[plugin_config.name] = plugin_config
+
+    missing = []
+    for name, plugin_data in get_config_store().read_many(by_name).items():
+        if plugin_data:
+            by_name[name].plugin_data = plugin_data
+        else:
+            missing.append(by_name[name])
+    return missing
+
+
 def get_all_plugins()->list[PluginConfig]:
-    bao = BaoClient()
-    plugins= list([PluginConfig(p) for p in bao.list_plugins()])
-    return sort_plugins(plugins)
\ No newline at end of file
+    """Load all plugins from the config store, the configs are read concurrently."""
+    names = set(get_config_store().list())
+    session = active_session()
+    if session:
+        names.update(session.pending())
+    plugins = [PluginConfig(name, lazy=True) for name in sorted(names)]
+    missing = prefetch(plugins)
+    plugins = [p for p in plugins if p not in missing]
+    return sort_plugins(plugins)
@@ -2,10 +2,14 @@ from freeds_setup.helpers.flog import logger
 
 from pathlib import Path
 from freeds_setup.helpers.root_config import root_config
-import freeds_setup.helpers.bao_client as bao_client
+from freeds_setup.helpers.config_store import get_config_store
 import freeds_setup.helpers.dc as dc
+from freeds_setup.importing.config_session import ConfigSession
+from freeds_setup.importing.dependency_graph import load_graph, update_graph
+from freeds_setup.importing.scheduler import run_in_dependency_order
 from freeds_setup.importing.plugin_config import PluginConfig, sort_plugins
-from freeds_setup.importing.resource_classes import resource_classes
+from freeds_setup.importing.plugin_scanner import DEFAULT_MAX_DEPTH, scan_plugins
+from freeds_setup.importing.resource_plan import ResourceAction, apply_resources, plan_resources
 from freeds_setup.helpers.flog import logger
 from freeds_setup.importing.plugin_config import PluginConfig
 
@@ -42,65 +46,146 @@ def process_dependencies(plugin_config: PluginConfig) -> None:
             )
 
 
-def provision_all(plugin_config: PluginConfig) -> None:
-    """Provision resources and update config."""döo
-    plugin = plugin_config.name
+def provision_all(plugin_config: PluginConfig, max_workers: int = 4, stored: dict = None) -> list[ResourceAction]:
+    """Provision resources and update config, returns the actions taken.
+    stored is the plugin's stored config, resources that are unchanged since then keep their outputs from its ledger.
+    Without stored everything is provisioned."""
     process_dependencies(plugin_config)
-    for name, resource in plugin_config.resources.items():
-        type = resource["type"]
-        resource_class = resource_classes.get(type.lower())
-        if not resource_class:
-            raise ValueError(f"Unknown resource type: {type} found in plugin {plugin}")
-        resource = resource_class(plugin_config, name, resource)
-        resource.provision()
-        plugin_config.config.update(resource.config)
+    stored_id = ((stored or {}).get("config") or {}).get("plugin_id")
+    if stored_id:
+        # keep the id of an imported plugin, a new one changes its env and restarts it
+        plugin_config.config["plugin_id"] = stored_id
+    actions = plan_resources(plugin_config, stored or {})
+    apply_resources(plugin_config, actions, stored or {}, max_workers=max_workers)
+    return actions
+
+
+def plan_import(plugin_configs: list[PluginConfig]) -> dict[str, list[ResourceAction]]:
+    """Plan the import of plugins without side effects, plugin name -> actions, see resource_plan."""
+    stored = get_config_store().read_many([p.name for p in plugin_configs])
+    plans = {}
+    for plugin_config in plugin_configs:
+        process_dependencies(plugin_config)
+        plans[plugin_config.name] = plan_resources(plugin_config, stored.get(plugin_config.name) or {})
+    return plans
+
+
+def unchanged_plugins(plugin_configs: list[PluginConfig], stored: dict[str, dict]) -> set[str]:
+    """Names of the plugins whose fingerprint matches their stored config."""
+    unchanged = set()
+    for plugin_config in plugin_configs:
+        fingerprint = plugin_config.meta.get("fingerprint")
+        if fingerprint and (stored.get(plugin_config.name) or {}).get("meta", {}).get("fingerprint") == fingerprint:
+            unchanged.add(plugin_config.name)
+    return unchanged
 
 
-def import_plugins(plugin_configs: PluginConfig | list[PluginConfig]) -> None:
+def import_plugins(
+    plugin_configs: PluginConfig | list[PluginConfig],
+    start: bool = True,
+    max_parallel: int = 4,
+    force: bool = False,
+    max_pulls: int = 3,
+) -> None:
     """
     Import a plugin, reads plugin.yaml, populates databses and secrets and stores in vault.
+    Plugins are imported in dependency order, up to max_parallel plugins whose dependencies are done run at once.
+    Config writes are collected in a ConfigSession, all plugins are provisioned first and written in one concurrent
+    flush, then (with start) they are started in dependency order, a running plugin reads its config from vault.
+    Plugins whose plugin.yaml and docker-compose.yaml are unchanged since the last import are skipped, unless force is set.
+    The fingerprint that decides this is only stored for plugins that were started (or provisioned, without start),
+    so a plugin whose import or start failed is imported again on the next run.
+    With start the images of all plugins are pulled in the background (max_pulls at a time) while they are provisioned.
     """
 
     if isinstance(plugin_configs, PluginConfig):
         plugin_configs = [plugin_configs]
 
+    # one concurrent read for the fingerprints and resource ledgers
+    stored = get_config_store().read_many([p.name for p in plugin_configs])
+    if not force:
+        unchanged = unchanged_plugins(plugin_configs, stored)
+        if unchanged:
+            logger.info(f"Skipping unchanged plugins: {sorted(unchanged)}, use force to import them anyway.")
+            plugin_configs = [p for p in plugin_configs if p.name not in unchanged]
+        if not plugin_configs:
+            return
+
     logger.commence(f"Import {len(plugin_configs)} plugins")
-    for plugin_config in plugin_configs:
+    if start:
+        dc.pull_in_background(plugin_configs, max_parallel=max_pulls)
+
+    # plugin name -> fingerprint, kept out of the stored config until the plugin is started
+    fingerprints = {}
+    started = []
+
+    def import_one(plugin_config: PluginConfig) -> None:
         logger.start(f"Plugin: {plugin_config.name}, {plugin_config.path} ")
-        provision_all(plugin_config)
-        bao = bao_client.BaoClient()
-        bao.write_plugin_config(plugin_config.name, plugin_config.plugin_data)
-        new_config = PluginConfig(plugin_config.name)
-        dc.start_plugin(new_config)
+        provision_all(plugin_config, stored=stored.get(plugin_config.name))
+        if start:
+            fingerprints[plugin_config.name] = plugin_config.meta.pop("fingerprint", None)
+        plugin_config.save_to_vault()
+        logger.progress(f"Plugin {plugin_config.name} provisioned")
+
+    def start_one(plugin_config: PluginConfig) -> None:
+        dc.start_plugin(plugin_config)
+        started.append(plugin_config)
 
-        logger.succeed()
+    try:
+        # the session is flushed once when it ends, before the first plugin starts
+        with ConfigSession():
+            run_in_dependency_order(plugin_configs, import_one, max_workers=max_parallel)
+        if start:
+            run_in_dependency_order(plugin_configs, start_one, max_workers=max_parallel)
+    except Exception:
+        dc.cancel_pulls()
+        raise
+    finally:
+        # checkpoint, the started plugins are done, also when others failed
+        meta = {}
+        for plugin_config in started:
+            if fingerprints.get(plugin_config.name):
+                plugin_config.meta["fingerprint"] = fingerprints[plugin_config.name]
+            meta[plugin_config.name] = {"meta": plugin_config.meta}
+        if meta:
+            get_config_store().write_many(meta)
+    update_graph(plugin_configs)
     logger.complete()
 
 
-def scan(path: Path = None) -> list[PluginConfig]:
+def import_affected(plugin: str, start: bool = True, max_parallel: int = 4) -> list[PluginConfig]:
     """
-    Scan folder and subfolders for plugins (folders with plugin.yaml).
+    Re-import a plugin and every plugin that depends on it, directly or indirectly, from their plugin folders.
+    They are imported whether they changed or not. Returns the imported plugin configs.
+    """
+    graph = load_graph()
+    if plugin not in graph.dependencies:
+        raise ValueError(f"Plugin {plugin} is not in the dependency graph, it must be imported first.")
+    plugin_configs = []
+    for name in graph.order(graph.affected_by(plugin)):
+        path = graph.paths.get(name)
+        if not path:
+            logger.warning(f"Plugin folder for {name} is not known, it's not re-imported.")
+            continue
+        plugin_configs.append(PluginConfig(Path(path)))
+    logger.info(f"Plugins affected by {plugin}: {[p.name for p in plugin_configs]}")
+    import_plugins(plugin_configs, start=start, max_parallel=max_parallel, force=True)
+    return plugin_configs
+
+
+def scan(path: Path = None, ignore: list[str] = None, max_depth: int = DEFAULT_MAX_DEPTH) -> list[PluginConfig]:
+    """
+    Scan folder and subfolders for plugins (folders with plugin.yaml), see plugin_scanner for the ignore rules.
     """
     if path is None:
         path = root_config.plugins_path
 
     logger.info(f"Scanning: {path}")
-    plugin_configs = []
-
-    for subfolder in path.rglob("*"):
-        if subfolder.is_dir():
-            if (subfolder / "plugin.yaml").exists():
-                p = PluginConfig(subfolder)
-                plugin_configs.append(p)
-
+    plugin_configs = scan_plugins(path, ignore=ignore, max_depth=max_depth)
     logger.info(f"Found plugins: {list([p.name for p in plugin_configs])}.")
     return plugin_configs
 
 
-
-
-
-
 if __name__ == "__main__":
     # print(get_all_plugins())
     # from freeds_setup.helpers.root_config import root_config
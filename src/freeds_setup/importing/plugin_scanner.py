@@ -0,0 +1,163 @@
+"""Find plugin folders (folders with a plugin.yaml) below a root folder.
+The walk uses os.scandir, skips ignored folders (hidden folders, node_modules, virtualenvs, data etc) and stops at max_depth.
+What was found is kept in a manifest in ~/.freeds/cache/scan_manifest.json keyed on the folder mtimes,
+a folder whose mtime is unchanged isn't listed again, so rescanning an unchanged tree costs one stat per folder.
+"""
+
+import fnmatch
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional
+from freeds_setup.helpers.flog import logger
+from freeds_setup.helpers.files import atomic_write
+from freeds_setup.helpers.root_config import root_config
+from freeds_setup.importing.plugin_config import PluginConfig
+
+DEFAULT_IGNORE = (
+    ".*",
+    "node_modules",
+    "__pycache__",
+    "venv",
+    "site-packages",
+    "data",
+    "dist",
+    "build",
+    "target",
+)
+DEFAULT_MAX_DEPTH = 6
+MANIFEST_VERSION = 1
+
+
+def ignore_patterns(extra: Iterable[str] = None) -> list[str]:
+    """Default ignore patterns plus FDS_SCAN_IGNORE (comma separated) plus extra, fnmatch style on folder names."""
+    patterns = list(DEFAULT_IGNORE)
+    patterns += [p.strip() for p in os.environ.get("FDS_SCAN_IGNORE", "").split(",") if p.strip()]
+    patterns += list(extra or [])
+    return patterns
+
+
+class PluginScanner:
+    def __init__(
+        self,
+        ignore: Iterable[str] = None,
+        max_depth: int = DEFAULT_MAX_DEPTH,
+        manifest_file: Optional[Path] = None,
+        max_workers: int = 8,
+    ):
+        """ignore replaces the ignore patterns, use ignore_patterns() to extend the defaults.
+        Without manifest_file every scan lists every folder."""
+        self.ignore = list(ignore) if ignore is not None else ignore_patterns()
+        self.max_depth = max_depth
+        self.manifest_file = manifest_file
+        self.max_workers = max_workers
+        # folder -> [mtime_ns, has plugin.yaml, subfolder names]
+        self._manifest: dict[str, dict[str, list]] = self._load_manifest()
+        self._lock = threading.Lock()
+
+    def _load_manifest(self) -> dict:
+        if not self.manifest_file:
+            return {}
+        try:
+            with open(self.manifest_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != MANIFEST_VERSION or data.get("ignore") != self.ignore:
+            # different ignore rules give different listings
+            return {}
+        return data.get("roots", {})
+
+    def _save_manifest(self) -> None:
+        if not self.manifest_file:
+            return
+        self.manifest_file.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(
+            self.manifest_file, json.dumps({"version": MANIFEST_VERSION, "ignore": self.ignore, "roots": self._manifest})
+        )
+
+    def _ignored(self, name: str) -> bool:
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.ignore)
+
+    def _list(self, folder: str) -> tuple[bool, list[str]]:
+        """List a folder, returns (has plugin.yaml, subfolders not ignored)."""
+        has_plugin = False
+        subfolders = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name == "pyvenv.cfg":
+                    # a virtualenv, whatever its name
+                    return False, []
+                if entry.name == "plugin.yaml":
+                    has_plugin = entry.is_file()
+                elif entry.is_dir(follow_symlinks=False) and not self._ignored(entry.name):
+                    subfolders.append(entry.name)
+        return has_plugin, sorted(subfolders)
+
+    def find(self, root: Path) -> list[Path]:
+        """Return the plugin folders below root (root included)."""
+        root = Path(root).resolve()
+        old = self._manifest.get(str(root), {})
+        new: dict[str, list] = {}
+        found = []
+        listed = 0
+        stack = [(str(root), 0)]
+        while stack:
+            folder, depth = stack.pop()
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except OSError:
+                continue
+            rel = os.path.relpath(folder, root)
+            entry = old.get(rel)
+            if not entry or entry[0] != mtime:
+                try:
+                    has_plugin, subfolders = self._list(folder)
+                except OSError as e:
+                    logger.warning(f"Can't scan {folder}: {e}")
+                    continue
+                entry = [mtime, has_plugin, subfolders]
+                listed += 1
+            new[rel] = entry
+            if entry[1]:
+                found.append(Path(folder))
+            if depth < self.max_depth:
+                stack.extend((os.path.join(folder, name), depth + 1) for name in reversed(entry[2]))
+        logger.debug(f"Scanned {len(new)} folders below {root}, {listed} listed.")
+        with self._lock:
+            self._manifest[str(root)] = new
+            if listed or len(new) != len(old):
+                self._save_manifest()
+        return sorted(found)
+
+    def folders(self, root: Path) -> list[Path]:
+        """The folders walked by the last find(root)."""
+        root = Path(root).resolve()
+        with self._lock:
+            return [Path(os.path.normpath(root / rel)) for rel in self._manifest.get(str(root), {})]
+
+    def scan(self, root: Path) -> list[PluginConfig]:
+        """Find the plugins below root and read their plugin.yaml files in parallel."""
+        folders = self.find(root)
+        if len(folders) < 2:
+            return [PluginConfig(folder) for folder in folders]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(folders)), thread_name_prefix="scan") as pool:
+            return list(pool.map(PluginConfig, folders))
+
+
+def manifest_file() -> Path:
+    return root_config.known_location / "cache" / "scan_manifest.json"
+
+
+def scan_plugins(
+    root: Path, ignore: Iterable[str] = None, max_depth: int = DEFAULT_MAX_DEPTH, use_manifest: bool = True
+) -> list[PluginConfig]:
+    """Scan root for plugins, ignore is added to the default ignore patterns."""
+    scanner = PluginScanner(
+        ignore=ignore_patterns(ignore),
+        max_depth=max_depth,
+        manifest_file=manifest_file() if use_manifest else None,
+    )
+    return scanner.scan(root)
@@ -0,0 +1,222 @@
+"""Watch a plugins tree and re-import plugins when their plugin.yaml or docker-compose.yaml changes.
+Uses inotify on linux (through ctypes, no extra dependency) and stat polling elsewhere. Bursts of events are
+debounced, then only plugins whose watched files have different content are provisioned, written and started.
+"""
+
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+from freeds_setup.helpers.flog import logger
+from freeds_setup.importing.plugin_config import PluginConfig, sort_plugins
+from freeds_setup.importing.plugin_import import import_plugins
+from freeds_setup.importing.plugin_scanner import DEFAULT_MAX_DEPTH, PluginScanner, ignore_patterns, manifest_file
+
+WATCHED_FILES = ("plugin.yaml", "docker-compose.yaml")
+
+# a change is (folder, kind), kind is "file" for a watched file and "tree" when folders or plugins came or went
+Change = tuple[Path, str]
+
+
+class PollingMonitor:
+    """Detect changes by comparing stat results, one stat per folder plus one per watched file in plugin folders."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._stats: dict[Path, tuple] = {}
+
+    @staticmethod
+    def _stat(folder: Path) -> tuple:
+        result = []
+        for name in ("",) + WATCHED_FILES:
+            try:
+                st = os.stat(folder / name)
+                result.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                result.append(None)
+        return tuple(result)
+
+    def watch(self, folders: Iterable[Path]) -> None:
+        self._stats = {folder: self._stats.get(folder) or self._stat(folder) for folder in folders}
+
+    def changes(self, timeout: float) -> set[Change]:
+        time.sleep(min(timeout, self.interval))
+        changes = set()
+        for folder, old in self._stats.items():
+            new = self._stat(folder)
+            if new == old:
+                continue
+            self._stats[folder] = new
+            # folder mtime or plugin.yaml coming/going is a tree change, content changes of watched files aren't
+            if new[0] != old[0] or (new[1] is None) != (old[1] is None):
+                changes.add((folder, "tree"))
+            if new[1:] != old[1:]:
+                changes.add((folder, "file"))
+        return changes
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyMonitor:
+    """Linux inotify on every folder of the tree, waits in select so an idle watch costs nothing."""
+
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_Q_OVERFLOW = 0x4000
+    IN_ISDIR = 0x40000000
+    IN_ONLYDIR = 0x01000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._folders: dict[int, Path] = {}
+        self._watches: dict[Path, int] = {}
+
+    def watch(self, folders: Iterable[Path]) -> None:
+        """Watch folders, watches on folders that are no longer in the tree are removed."""
+        folders = set(folders)
+        for folder in set(self._watches) - folders:
+            wd = self._watches.pop(folder)
+            self._folders.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+        for folder in folders - set(self._watches):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), self.MASK)
+            if wd < 0:
+                logger.warning(f"Can't watch {folder}: {os.strerror(ctypes.get_errno())}")
+                continue
+            self._watches[folder] = wd
+            self._folders[wd] = folder
+
+    def changes(self, timeout: float) -> set[Change]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        changes = set()
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = self.EVENT.unpack_from(buffer, offset)
+            name = buffer[offset + self.EVENT.size : offset + self.EVENT.size + length].rstrip(b"\0").decode()
+            offset += self.EVENT.size + length
+            if mask & self.IN_Q_OVERFLOW:
+                # events were lost, check everything
+                changes.update((folder, kind) for folder in self._watches for kind in ("file", "tree"))
+                continue
+            folder = self._folders.get(wd)
+            if folder is None:
+                continue
+            if mask & (self.IN_ISDIR | self.IN_DELETE_SELF):
+                changes.add((folder, "tree"))
+            elif name in WATCHED_FILES:
+                changes.add((folder, "file"))
+                if name == "plugin.yaml" and mask & (self.IN_CREATE | self.IN_DELETE | self.IN_MOVED_FROM | self.IN_MOVED_TO):
+                    changes.add((folder, "tree"))
+        return changes
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def make_monitor(poll_interval: float = 0.5):
+    """inotify if the platform has it, stat polling otherwise."""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyMonitor()
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify is not available ({e}), polling for changes.")
+    return PollingMonitor(poll_interval)
+
+
+def fingerprint(plugin_folder: Path) -> Optional[str]:
+    """Hash of the watched files of a plugin, None if plugin.yaml is gone."""
+    digest = hashlib.blake2b(digest_size=16)
+    for name in WATCHED_FILES:
+        try:
+            digest.update((plugin_folder / name).read_bytes())
+        except FileNotFoundError:
+            if name == "plugin.yaml":
+                return None
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def watch(
+    root: Path,
+    ignore: Iterable[str] = None,
+    max_depth: int = DEFAULT_MAX_DEPTH,
+    debounce: float = 0.2,
+    poll_interval: float = 0.5,
+    max_parallel: int = 4,
+) -> None:
+    """Watch root for plugin changes and re-import changed plugins until interrupted."""
+    root = Path(root).resolve()
+    scanner = PluginScanner(ignore=ignore_patterns(ignore), max_depth=max_depth, manifest_file=manifest_file())
+    fingerprints = {folder: fingerprint(folder) for folder in scanner.find(root)}
+    monitor = make_monitor(poll_interval)
+    monitor.watch(scanner.folders(root))
+    logger.info(f"Watching {len(fingerprints)} plugins below {root} with {type(monitor).__name__}, ctrl-c to stop.")
+
+    try:
+        while True:
+            changes = monitor.changes(timeout=poll_interval)
+            if not changes:
+                continue
+            # wait for the burst to end, editors and git checkouts write several files in a row
+            quiet_until = time.monotonic() + debounce
+            while time.monotonic() < quiet_until:
+                more = monitor.changes(timeout=max(0.0, quiet_until - time.monotonic()))
+                if more:
+                    changes |= more
+                    quiet_until = time.monotonic() + debounce
+
+            dirty = {folder for folder, kind in changes if kind == "file"}
+            if any(kind == "tree" for _, kind in changes):
+                # only folders with a changed mtime are listed again
+                plugins = set(scanner.find(root))
+                monitor.watch(scanner.folders(root))
+                for folder in set(fingerprints) - plugins:
+                    logger.info(f"Plugin folder {folder} is gone, it's no longer watched.")
+                    del fingerprints[folder]
+                dirty |= plugins - set(fingerprints)
+
+            # hashed before the import, an edit during the import is picked up by the next round
+            changed = {}
+            for folder in dirty:
+                new = fingerprint(folder)
+                if new is not None and new != fingerprints.get(folder):
+                    changed[folder] = new
+            if not changed:
+                continue
+
+            started = time.monotonic()
+            try:
+                plugin_configs = sort_plugins([PluginConfig(folder) for folder in changed])
+                import_plugins(plugin_configs, start=True, max_parallel=max_parallel)
+            except Exception as e:
+                # keep the old fingerprints so the next save retries
+                logger.error(f"Re-import of {[f.name for f in changed]} failed: {e}")
+                continue
+            fingerprints.update(changed)
+            logger.info(f"Re-imported {[p.name for p in plugin_configs]} in {time.monotonic() - started:.2f}s")
+    except KeyboardInterrupt:
+        logger.info("Stopped watching.")
+    finally:
+        monitor.close()
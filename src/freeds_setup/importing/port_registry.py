@@ -0,0 +1,237 @@
+"""Registry of the ports handed out to plugins.
+Stored as the internal config entry _ports: {"range": [first, last], "allocated": {"<port>": "<owner>"},
+"shared": {"<port>": ["<owner>", ...]}}, the owner is <plugin>.<resource>. A known port declared by more than one
+plugin is shared, the later ones are recorded in "shared" and the port stays taken until all of them released it. Changes are check-and-set writes on the entry version, so two imports
+can't hand out the same port. In memory the allocated ports are a bitmap, finding a free port is a byte search.
+"""
+
+import socket
+import threading
+import time
+from typing import Optional
+from freeds_setup.helpers.config_store import ConfigStore, get_config_store
+from freeds_setup.helpers.flog import logger
+from freeds_setup.helpers.resilience import backoff_delay
+
+REGISTRY_ENTRY = "_ports"
+
+
+class PortRegistry:
+    def __init__(
+        self,
+        store: ConfigStore = None,
+        first: int = 8000,
+        last: int = 9000,
+        check_bind: bool = False,
+        retries: int = 8,
+    ):
+        """Ports are allocated in first..last-1. With check_bind a port is only handed out if it can be bound locally."""
+        self.store = store or get_config_store()
+        self.first = first
+        self.last = last
+        self.check_bind = check_bind
+        self.retries = retries
+        self._lock = threading.Lock()
+        self._version = None
+        self._owners: dict[int, str] = {}
+        self._shared: dict[int, list[str]] = {}
+        self._by_owner: dict[str, int] = {}
+        self._bitmap = bytearray(last - first)
+
+    def _load(self, version: int, data: dict) -> None:
+        """Replace the in memory state with the stored entry."""
+        self._version = version
+        self._owners = {int(port): owner for port, owner in (data.get("allocated") or {}).items()}
+        self._shared = {int(port): list(owners) for port, owners in (data.get("shared") or {}).items() if owners}
+        self._by_owner = {owner: port for port, owner in self._owners.items()}
+        for port, owners in self._shared.items():
+            self._by_owner.update((owner, port) for owner in owners)
+        self._bitmap = bytearray(self.last - self.first)
+        for port in self._owners:
+            if self.first <= port < self.last:
+                self._bitmap[port - self.first] = 1
+
+    def _refresh(self, fresh: bool = False) -> None:
+        if self._version is not None and not fresh:
+            return
+        version, data = self.store.read_versioned(REGISTRY_ENTRY)
+        if not version:
+            data = self._seed()
+        self._load(version, data)
+
+    def _seed(self) -> dict:
+        """First use, take over the ports already in the stored plugin configs."""
+        allocated = {}
+        shared = {}
+        for plugin, config in self.store.read_all().items():
+            for name, resource in (config.get("resources") or {}).items():
+                if str(resource.get("type", "")).lower() not in ("knownport", "ui"):
+                    continue
+                port = (resource.get("params") or {}).get("number")
+                if not port:
+                    continue
+                if str(int(port)) in allocated:
+                    shared.setdefault(str(int(port)), []).append(f"{plugin}.{name}")
+                else:
+                    allocated[str(int(port))] = f"{plugin}.{name}"
+        logger.info(f"Seeded port registry with {len(allocated)} ports from the stored plugins.")
+        return {"allocated": allocated, "shared": shared}
+
+    def _to_dict(self) -> dict:
+        data = {
+            "range": [self.first, self.last],
+            "allocated": {str(port): owner for port, owner in sorted(self._owners.items())},
+        }
+        if self._shared:
+            data["shared"] = {str(port): owners for port, owners in sorted(self._shared.items())}
+        return data
+
+    def _is_bindable(self, port: int) -> bool:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            try:
+                s.bind(("0.0.0.0", port))
+                return True
+            except OSError:
+                return False
+
+    def _find_free(self, preferred: Optional[int] = None) -> Optional[int]:
+        if preferred and self.first <= preferred < self.last and not self._bitmap[preferred - self.first]:
+            if not self.check_bind or self._is_bindable(preferred):
+                return preferred
+        index = self._bitmap.find(0)
+        while index != -1:
+            port = self.first + index
+            if not self.check_bind or self._is_bindable(port):
+                return port
+            index = self._bitmap.find(0, index + 1)
+        return None
+
+    def _commit(self, change) -> Optional[int]:
+        """Apply change to the in memory state and write it with check-and-set, re-read and retry on conflict.
+        change returns the port it allocated or released, None when there was nothing to do."""
+        with self._lock:
+            for attempt in range(self.retries + 1):
+                self._refresh(fresh=attempt > 0)
+                result, changed = change()
+                if not changed:
+                    return result
+                try:
+                    written = self.store.write_versioned(REGISTRY_ENTRY, self._to_dict(), self._version)
+                except Exception:
+                    # the in memory state has the unwritten change, drop it
+                    self._version = None
+                    raise
+                if written:
+                    # the store doesn't return the new version, read it on the next change
+                    self._version = None
+                    return result
+                logger.debug("Port registry was changed by someone else, retrying")
+                time.sleep(backoff_delay(attempt, base=0.05))
+            raise RuntimeError(f"Updating the port registry failed, it was changed by someone else {self.retries + 1} times.")
+
+    def allocate(self, owner: str, preferred: Optional[int] = None) -> int:
+        """Return the port of owner, allocating a free one if it has none. preferred is used if it is free."""
+
+        def change():
+            if owner in self._by_owner:
+                return self._by_owner[owner], False
+            port = self._find_free(preferred)
+            if port is None:
+                raise RuntimeError(f"No free port left in {self.first}-{self.last - 1} for {owner}.")
+            self._owners[port] = owner
+            self._by_owner[owner] = port
+            self._bitmap[port - self.first] = 1
+            return port, True
+
+        port = self._commit(change)
+        logger.debug(f"Port {port} is allocated to {owner}")
+        return port
+
+    def reserve(self, owner: str, port: int) -> None:
+        """Record a fixed port, e.g. a known port. If it belongs to someone else it's shared, with a warning,
+        two plugins declaring the same well known port may well be meant to run one at a time."""
+
+        def change():
+            if self._by_owner.get(owner) == port:
+                return port, False
+            if owner in self._by_owner:
+                self._remove_owner(owner)
+            current = self._owners.get(port)
+            if current is not None:
+                logger.warning(f"Port {port} of {owner} is also used by {current}, they can't run at the same time.")
+                self._shared.setdefault(port, []).append(owner)
+            else:
+                self._owners[port] = owner
+                if self.first <= port < self.last:
+                    self._bitmap[port - self.first] = 1
+            self._by_owner[owner] = port
+            return port, True
+
+        self._commit(change)
+
+    def release(self, port: int = None, owner: str = None) -> Optional[int]:
+        """Release a port, by number (for all its owners) or by owner (a shared port stays with the other owners).
+        Returns the released port, None if it wasn't allocated."""
+
+        def change():
+            if port is not None:
+                if port not in self._owners:
+                    return None, False
+                self._unset(port)
+                return port, True
+            if owner not in self._by_owner:
+                return None, False
+            return self._remove_owner(owner), True
+
+        return self._commit(change)
+
+    def release_plugin(self, plugin: str) -> list[int]:
+        """Release every port owned by a plugin's resources."""
+
+        def change():
+            owners = [o for o in self._by_owner if o.split(".", 1)[0] == plugin]
+            ports = sorted({self._remove_owner(o) for o in owners})
+            return ports, bool(ports)
+
+        return self._commit(change)
+
+    def _unset(self, port: int) -> None:
+        """Free a port, for all its owners."""
+        owner = self._owners.pop(port)
+        self._by_owner.pop(owner, None)
+        for shared in self._shared.pop(port, []):
+            self._by_owner.pop(shared, None)
+        if self.first <= port < self.last:
+            self._bitmap[port - self.first] = 0
+
+    def _remove_owner(self, owner: str) -> int:
+        """Take owner off its port, a shared port goes to the next owner. Returns the port."""
+        port = self._by_owner.pop(owner)
+        shared = self._shared.get(port, [])
+        if owner in shared:
+            shared.remove(owner)
+        elif shared:
+            self._owners[port] = shared.pop(0)
+        else:
+            self._unset(port)
+        if not shared:
+            self._shared.pop(port, None)
+        return port
+
+    def allocated(self) -> dict[int, str]:
+        with self._lock:
+            self._refresh(fresh=True)
+            return dict(self._owners)
+
+
+_registry: Optional[PortRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_port_registry() -> PortRegistry:
+    """Return the process wide port registry on the process wide config store."""
+    global _registry
+    with _registry_lock:
+        if _registry is None or _registry.store is not get_config_store():
+            _registry = PortRegistry()
+        return _registry
@@ -4,13 +4,16 @@ import secrets
 import string
 from freeds_setup.helpers.root_config import root_config
 from freeds_setup.importing.plugin_config import PluginConfig
-from freeds_setup.importing.plugin_config import get_all_plugins
+from freeds_setup.importing.port_registry import get_port_registry
 
 class Resource(ABC):
     """
     Base class for resources (which include dependencies)
     """
 
+    # parallel_safe resources are provisioned concurrently, they must not depend on config set by other resources
+    parallel_safe = True
+
     def __init__(self, plugin_config:PluginConfig, name:str, resource:dict):
         self.plugin_config = plugin_config
         self.plugin_name = plugin_config.name
@@ -31,6 +34,10 @@ class Resource(ABC):
         """Provision the resource and update the config property."""
         pass
 
+    def release(self) -> None:
+        """Called when the resource is removed from the plugin, most resources have nothing to release."""
+        pass
+
 class InformationalResource(Resource):
     """Base class for informational resources that don't (yet) perform any actions."""
 
@@ -82,19 +89,16 @@ class DataDir(Resource):
         data_dir.mkdir(parents=True, exist_ok=True)
         self.config[self._config_name('datadir', name)] = str(data_dir)
 
-def get_free_port_number()->int:
-    all_ports = []
-
-    for plugin in get_all_plugins():
-        all_ports.extend(plugin.ports)
-
-    for port in range(8000,9000):
-        if port not in all_ports:
-            return port
+def get_free_port_number(owner: str, preferred: int = None)->int:
+    """Allocate a port in the port registry, owner is <plugin>.<resource> and gets the same port every time."""
+    return get_port_registry().allocate(owner, preferred)
 
 
 class Ui(Resource):
     """Assigns a free port for the UI and resolves the uri using the config env variables"""
+    # the uri is resolved from config set by the other resources
+    parallel_safe = False
+
     def provision(self):
         """Find a free port in the ui range and resolve the uri."""
         uri = self._get_param('uri')
@@ -103,22 +107,34 @@ class Ui(Resource):
         known_port = self._get_param('known_port')
 
         if not (number or known_port):
-            number = get_free_port_number()
+            number = get_free_port_number(f"{self.plugin_name}.{self.name}")
             self.params['number'] = number
         self.config[self._config_name('ui_port', name)] = number
         tmpl = Template(uri)
         uri = tmpl.safe_substitute(self.plugin_config.get_env())
         self.config[self._config_name('ui_uri', name)] = uri
 
+    def release(self):
+        get_port_registry().release(owner=f"{self.plugin_name}.{self.name}")
+
 class PostgresDatabase(Resource):
     pass
 
 class S3(Resource):
     pass
 
-class KnownPort(InformationalResource):
+class KnownPort(Resource):
     """Allow plugins to reserve specific ports, typically a well know port for some service."""
-    pass
+
+    def provision(self):
+        """Record the port in the port registry so it isn't handed out to a ui.
+        A port another plugin declared too is shared with a warning, it doesn't fail the import."""
+        number = self._get_param('number')
+        if number:
+            get_port_registry().reserve(f"{self.plugin_name}.{self.name}", int(number))
+
+    def release(self):
+        get_port_registry().release(owner=f"{self.plugin_name}.{self.name}")
 
 
 resource_classes = {
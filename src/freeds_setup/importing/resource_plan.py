@@ -0,0 +1,153 @@
+"""Plan and apply resource provisioning against a ledger of what was provisioned before.
+The ledger is kept in the plugin's meta: resource name -> {"spec": {"type", "params"}, "params": params after provisioning,
+"outputs": {config key: value}}.
+A resource whose spec is unchanged isn't provisioned again, its outputs are copied from the ledger,
+so passwords etc stay the same over re-imports and the plugin doesn't need a restart.
+"""
+
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from freeds_setup.helpers.flog import logger
+from freeds_setup.importing.plugin_config import PluginConfig
+from freeds_setup.importing.resource_classes import Resource, resource_classes
+
+CREATE = "create"
+UPDATE = "update"
+NOOP = "no-op"
+DELETE = "delete"
+
+
+class ResourceAction:
+    """What to do with one resource, resource is None for the plugin itself (its config and compose file)."""
+
+    def __init__(self, plugin: str, resource: str, type: str, action: str, reason: str = "", spec: dict = None):
+        self.plugin = plugin
+        self.resource = resource
+        self.type = type
+        self.action = action
+        self.reason = reason
+        self.spec = spec
+
+    @property
+    def target(self) -> str:
+        return f"{self.plugin}.{self.resource}" if self.resource else self.plugin
+
+    def __repr__(self) -> str:
+        return f"<ResourceAction {self.action} {self.target}>"
+
+
+def resource_spec(resource: dict) -> dict:
+    """The part of a resource definition that decides what is provisioned."""
+    return {"type": resource["type"], "params": copy.deepcopy(resource.get("params") or {})}
+
+
+def get_ledger(plugin_data: dict) -> dict:
+    return ((plugin_data or {}).get("meta") or {}).get("ledger") or {}
+
+
+def resource_class(plugin: str, type: str) -> type[Resource]:
+    cls = resource_classes.get(type.lower())
+    if not cls:
+        raise ValueError(f"Unknown resource type: {type} found in plugin {plugin}")
+    return cls
+
+
+def plan_resources(plugin_config: PluginConfig, stored: dict) -> list[ResourceAction]:
+    """Compare the plugin with its stored config, stored is {} for a plugin that isn't imported yet.
+    The first action is for the plugin itself, then one per resource. Nothing is changed."""
+    plugin = plugin_config.name
+    if not stored:
+        actions = [ResourceAction(plugin, None, "plugin", CREATE, "not imported")]
+    elif (stored.get("meta") or {}).get("fingerprint") != plugin_config.meta.get("fingerprint"):
+        actions = [ResourceAction(plugin, None, "plugin", UPDATE, "plugin.yaml or docker-compose.yaml changed")]
+    else:
+        actions = [ResourceAction(plugin, None, "plugin", NOOP)]
+
+    ledger = get_ledger(stored)
+    for name, resource in plugin_config.resources.items():
+        spec = resource_spec(resource)
+        resource_class(plugin, spec["type"])
+        entry = ledger.get(name)
+        if entry is None:
+            actions.append(ResourceAction(plugin, name, spec["type"], CREATE, "new", spec))
+        elif entry.get("spec") != spec:
+            actions.append(ResourceAction(plugin, name, spec["type"], UPDATE, "params changed", spec))
+        else:
+            actions.append(ResourceAction(plugin, name, spec["type"], NOOP, spec=spec))
+
+    # resources that aren't parallel_safe read the plugin config, e.g. a ui uri template resolves the plugin's host,
+    # they re-run when the plugin's own config or the output of any other resource changed
+    if actions[0].action != NOOP:
+        reason = "plugin config changed"
+    elif any(a.action != NOOP for a in actions[1:]):
+        reason = "uses output of changed resources"
+    else:
+        reason = None
+    if reason:
+        for a in actions[1:]:
+            if a.action == NOOP and not resource_class(plugin, a.type).parallel_safe:
+                a.action = UPDATE
+                a.reason = reason
+
+    for name, entry in ledger.items():
+        if name not in plugin_config.resources:
+            spec = entry.get("spec") or {}
+            actions.append(ResourceAction(plugin, name, spec.get("type", "?"), DELETE, "removed from plugin.yaml", spec))
+    return actions
+
+
+def apply_resources(plugin_config: PluginConfig, actions: list[ResourceAction], stored: dict, max_workers: int = 4) -> None:
+    """Provision the created and updated resources, restore the outputs of unchanged ones from the ledger,
+    release deleted ones and record the new ledger in the plugin's meta.
+    Resources that are independent (parallel_safe) are provisioned concurrently, the others after them in order."""
+    ledger = copy.deepcopy(get_ledger(stored))
+    for action in actions:
+        if action.resource and action.action == NOOP:
+            entry = ledger[action.resource]
+            plugin_config.config.update(entry.get("outputs") or {})
+            # provisioning may fill in params, e.g. the port number of a ui
+            if entry.get("params"):
+                plugin_config.resources[action.resource]["params"] = copy.deepcopy(entry["params"])
+
+    runs = []
+    for action in actions:
+        if action.resource and action.action in (CREATE, UPDATE):
+            cls = resource_class(plugin_config.name, action.type)
+            runs.append((action, cls(plugin_config, action.resource, plugin_config.resources[action.resource])))
+
+    def run_independent(action: ResourceAction, resource: Resource) -> None:
+        # independent resources don't read the plugin config, they write to their own dict, merged afterwards
+        resource.config = {}
+        logger.debug(f"Provisioning {action.target} ({action.action}, {action.reason})")
+        resource.provision()
+        ledger[action.resource] = {"spec": action.spec, "params": resource.params, "outputs": resource.config}
+
+    independent = [(a, r) for a, r in runs if r.parallel_safe]
+    if len(independent) > 1 and max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="provision") as pool:
+            for future in [pool.submit(run_independent, a, r) for a, r in independent]:
+                future.result()
+    else:
+        for a, r in independent:
+            run_independent(a, r)
+    for a, r in independent:
+        plugin_config.config.update(r.config)
+
+    for action, resource in runs:
+        if resource.parallel_safe:
+            continue
+        # these read the plugin config, the outputs are what they added or changed
+        before = copy.deepcopy(plugin_config.config)
+        logger.debug(f"Provisioning {action.target} ({action.action}, {action.reason})")
+        resource.provision()
+        outputs = {k: v for k, v in plugin_config.config.items() if k not in before or before[k] != v}
+        ledger[action.resource] = {"spec": action.spec, "params": resource.params, "outputs": outputs}
+
+    for action in actions:
+        if action.action == DELETE:
+            cls = resource_classes.get(action.type.lower())
+            if cls:
+                cls(plugin_config, action.resource, action.spec).release()
+            ledger.pop(action.resource, None)
+
+    plugin_config.meta["ledger"] = ledger
@@ -0,0 +1,48 @@
+"""Run per plugin work in dependency order, with independent plugins in parallel."""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from graphlib import TopologicalSorter
+from typing import Callable
+from freeds_setup.helpers.flog import logger
+from freeds_setup.importing.plugin_config import PluginConfig
+
+
+def run_in_dependency_order(
+    plugin_configs: list[PluginConfig],
+    action: Callable[[PluginConfig], None],
+    max_workers: int = 4,
+) -> None:
+    """Call action for every plugin, a plugin is released as soon as all its dependencies are done.
+    vault is always done first, on its own. Dependencies on plugins that aren't in plugin_configs are
+    considered done already. If an action fails no new plugins are started, the running ones are
+    allowed to finish and the first error is raised."""
+    by_name = {p.name: p for p in plugin_configs}
+    vault = by_name.pop("vault", None)
+    if vault:
+        action(vault)
+
+    deps = {name: [d for d in p.dependencies if d in by_name] for name, p in by_name.items()}
+    ts = TopologicalSorter(deps)
+    ts.prepare()
+
+    error = None
+    running: dict[Future, str] = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="import") as pool:
+        while ts.is_active():
+            if error is None:
+                for name in ts.get_ready():
+                    running[pool.submit(action, by_name[name])] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Plugin {name} failed: {e}")
+                    error = error or e
+                    continue
+                ts.done(name)
+    if error:
+        raise error
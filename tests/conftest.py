@@ -0,0 +1,41 @@
+"""The tests run against a file config store in a temporary home, no vault or docker needed."""
+
+import os
+import tempfile
+from pathlib import Path
+
+# root_config reads ~/.freeds when freeds_setup is imported, point home at a scratch folder first
+_home = Path(tempfile.mkdtemp(prefix="freeds-test-home-"))
+(_home / ".freeds").mkdir()
+(_home / ".freeds" / "freeds_dir").write_text(str(_home / "freeds"))
+os.environ["HOME"] = str(_home)
+os.environ["FDS_CONFIG_STORE"] = "file"
+os.environ["FDS_CONFIG_DIR"] = str(_home / "config")
+
+import pytest
+import yaml
+from freeds_setup.helpers.config_store import FileConfigStore, set_config_store
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path: Path) -> FileConfigStore:
+    """A fresh file config store for every test."""
+    store = FileConfigStore(tmp_path / "config")
+    set_config_store(store)
+    yield store
+    set_config_store(None)
+
+
+@pytest.fixture
+def make_plugin(tmp_path: Path):
+    """Write a plugin folder, returns its path. plugin is the content of the root element of plugin.yaml."""
+
+    def make(name: str, plugin: dict = None, compose: dict = None) -> Path:
+        folder = tmp_path / "plugins" / name
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / "plugin.yaml").write_text(yaml.safe_dump({"plugin": {"config": {}, **(plugin or {})}}))
+        if compose is not None:
+            (folder / "docker-compose.yaml").write_text(yaml.safe_dump(compose))
+        return folder
+
+    return make
@@ -0,0 +1,104 @@
+import json
+import pytest
+from freeds_setup.helpers import bao_client
+from freeds_setup.helpers.bao_client import BaoClient
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body: dict = None):
+        self.status_code = status_code
+        self.text = json.dumps(body or {})
+        self._body = body or {}
+
+    def json(self) -> dict:
+        return self._body
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeKV:
+    """A session answering the KV v2 data and metadata endpoints from a dict, records the requests it got."""
+
+    def __init__(self, client: BaoClient):
+        self.paths = client.paths
+        self.secrets: dict[str, tuple[int, dict]] = {}
+        self.calls: list[tuple[str, str]] = []
+        # called before a write is applied, lets a test change the secret under the writer's feet
+        self.before_write = None
+
+    def request(self, method, url, headers=None, timeout=None, json=None):
+        kind, plugin = url.removeprefix(self.paths.v1_path + "/config/").split("/", 1)
+        self.calls.append((method, kind))
+        version, data = self.secrets.get(plugin, (0, {}))
+        if method == "GET" and kind == "metadata":
+            if not version:
+                return FakeResponse(404)
+            return FakeResponse(200, {"data": {"current_version": version}})
+        if method == "GET":
+            if not version:
+                return FakeResponse(404)
+            return FakeResponse(200, {"data": {"data": data, "metadata": {"version": version}}})
+        if self.before_write:
+            self.before_write(plugin)
+            self.before_write = None
+            version, data = self.secrets.get(plugin, (0, {}))
+        if method == "POST":
+            cas = (json.get("options") or {}).get("cas")
+            if cas is not None and cas != version:
+                return FakeResponse(400, {"errors": ["check-and-set parameter did not match the current version"]})
+            self.secrets[plugin] = (version + 1, json["data"])
+            return FakeResponse(200, {"data": {"version": version + 1}})
+        if method == "PATCH":
+            if not version:
+                return FakeResponse(404)
+            self.secrets[plugin] = (version + 1, bao_client.merge_patch(dict(data), json["data"]))
+            return FakeResponse(200, {"data": {"version": version + 1}})
+        raise AssertionError(f"unexpected {method} {url}")
+
+
+@pytest.fixture
+def vault(monkeypatch):
+    monkeypatch.setattr(bao_client.time, "sleep", lambda seconds: None)
+    client = BaoClient(trust_seconds=60)
+    client.session = FakeKV(client)
+    return client
+
+
+def test_cas_conflict_rereads_and_retries(vault):
+    vault.session.secrets["demo"] = (1, {"a": 1})
+    assert vault.read_plugin_config("demo") == {"a": 1}
+
+    # another writer gets in between our cached read and our write
+    vault.session.before_write = lambda plugin: vault.session.secrets.update({plugin: (2, {"a": 1, "b": 2})})
+    vault.write_plugin_config("demo", {"c": 3}, mode="cas")
+
+    assert vault.session.secrets["demo"] == (3, {"a": 1, "b": 2, "c": 3})
+    # the conflict forced a fresh read of the data, not a second try on the stale cache
+    assert vault.session.calls[-3:] == [("POST", "data"), ("GET", "data"), ("POST", "data")]
+    assert vault.cache.get("demo").version == 3
+
+
+def test_patch_updates_cached_version(vault):
+    vault.session.secrets["demo"] = (1, {"a": 1, "nested": {"x": 1, "y": 2}})
+    vault.read_plugin_config("demo")
+    vault.patch_plugin_config("demo", {"nested": {"y": None}, "b": 2})
+
+    entry = vault.cache.get("demo")
+    assert entry.version == 2
+    assert entry.data == {"a": 1, "nested": {"x": 1}, "b": 2}
+    assert entry.data == vault.session.secrets["demo"][1]
+
+
+def test_cache_hit_within_trust_seconds_skips_metadata_read(vault):
+    vault.session.secrets["demo"] = (1, {"a": 1})
+    assert vault.read_plugin_config("demo") == {"a": 1}
+    calls = len(vault.session.calls)
+    assert vault.read_plugin_config("demo") == {"a": 1}
+    assert len(vault.session.calls) == calls
+
+    # once the entry is older than trust_seconds only the version is checked
+    vault.trust_seconds = 0
+    assert vault.read_plugin_config("demo") == {"a": 1}
+    assert vault.session.calls[calls:] == [("GET", "metadata")]
@@ -0,0 +1,98 @@
+import pytest
+import yaml
+from freeds_setup.helpers import compose_merge, dc
+from freeds_setup.importing.plugin_config import PluginConfig
+
+DB_COMPOSE = {
+    "services": {
+        "postgres": {
+            "image": "postgres:${PG_VERSION:-17}",
+            "environment": {"POSTGRES_PASSWORD": "${FDS_DB_ADMIN_PASSWORD}", "PROMPT": "$$HOME"},
+            "volumes": ["data:/var/lib/postgresql/data", "./init:/docker-entrypoint-initdb.d"],
+            "healthcheck": {"test": ["CMD", "pg_isready"]},
+        }
+    },
+    "volumes": {"data": {}},
+}
+APP_COMPOSE = {
+    "services": {
+        "web": {"image": "app", "depends_on": ["worker"], "secrets": ["token"]},
+        "worker": {"image": "worker"},
+    },
+    "secrets": {"token": {"file": "./token.txt"}},
+}
+
+
+@pytest.fixture
+def stack(make_plugin, monkeypatch):
+    monkeypatch.delenv("PG_VERSION", raising=False)
+    db = make_plugin("db", {"config": {"admin_password": "pa$s"}}, DB_COMPOSE)
+    app = make_plugin("app", {"dependencies": {"db": {}}}, APP_COMPOSE)
+    plugin_configs = [PluginConfig(db), PluginConfig(app)]
+    for plugin_config in plugin_configs:
+        plugin_config.save_to_vault()
+    return plugin_configs
+
+
+def test_services_and_volumes_are_renamed(stack):
+    db, app = stack
+    merged = compose_merge.merge_plugins(stack)
+    assert set(merged["services"]) == {"db-postgres", "app-web", "app-worker"}
+
+    postgres = merged["services"]["db-postgres"]
+    assert postgres["volumes"] == [
+        "db_data:/var/lib/postgresql/data",
+        f"{db.path / 'init'}:/docker-entrypoint-initdb.d",
+    ]
+    assert merged["volumes"]["db_data"] == {"name": "db_data"}
+    assert postgres["networks"] == {"db_default": {"aliases": ["postgres"]}}
+
+    web = merged["services"]["app-web"]
+    assert web["secrets"] == [{"source": "app_token", "target": "token"}]
+    assert merged["secrets"]["app_token"] == {"file": str(app.path / "token.txt")}
+
+
+def test_dependencies_wait_for_healthy_services(stack):
+    merged = compose_merge.merge_plugins(stack)
+    assert merged["services"]["app-web"]["depends_on"] == {
+        "app-worker": {"condition": "service_started"},
+        "db-postgres": {"condition": "service_healthy"},
+    }
+    assert "depends_on" not in merged["services"]["db-postgres"]
+
+
+def test_values_are_interpolated_and_escaped_again(stack):
+    postgres = compose_merge.merge_plugins(stack)["services"]["db-postgres"]
+    assert postgres["image"] == "postgres:17"
+    # compose interpolates the merged file once more, a $ from the config or an escaped $$ must stay literal
+    assert postgres["environment"] == {"POSTGRES_PASSWORD": "pa$$s", "PROMPT": "$$HOME"}
+
+
+def test_interpolate():
+    env = {"SET": "value", "EMPTY": ""}
+    assert compose_merge.interpolate("${SET}-$SET-${MISSING:-default}-${EMPTY-unset}", env, "test") == "value-value-default-"
+    assert compose_merge.interpolate("${SET:+yes}${MISSING:+no}$$", env, "test") == "yes$"
+    with pytest.raises(ValueError):
+        compose_merge.interpolate("${MISSING:?needed}", env, "test")
+
+
+def test_merged_up_of_some_plugins_keeps_the_whole_stack(stack, monkeypatch):
+    calls = []
+    monkeypatch.setattr(dc, "execute_dc", lambda args, work_path=None: calls.append(args))
+
+    compose_merge.merged_up([PluginConfig("app")])
+    path = compose_merge.compose_dir() / "docker-compose.yaml"
+    merged = yaml.safe_load(path.read_text())
+    assert set(merged["services"]) == {"db-postgres", "app-web", "app-worker"}
+    assert calls[-1][-2:] == ["app-web", "app-worker"]
+
+    compose_merge.merged_up()
+    assert calls[-1] == ["-p", "freeds", "up", "-d", "--remove-orphans"]
+
+
+def test_plugin_config_wins_over_the_shell(stack, monkeypatch):
+    monkeypatch.setenv("FDS_DB_ADMIN_PASSWORD", "from-shell")
+    monkeypatch.setenv("PG_VERSION", "16")
+    postgres = compose_merge.merge_plugins(stack)["services"]["db-postgres"]
+    assert postgres["environment"]["POSTGRES_PASSWORD"] == "pa$$s"
+    assert postgres["image"] == "postgres:16"
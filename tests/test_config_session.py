@@ -0,0 +1,25 @@
+import pytest
+from freeds_setup.importing.config_session import ConfigSession
+from freeds_setup.importing.plugin_config import PluginConfig
+
+
+def test_staged_configs_are_written_when_the_session_ends(make_plugin, store):
+    with ConfigSession() as session:
+        plugin_config = PluginConfig(make_plugin("a"))
+        plugin_config.save_to_vault()
+        assert store.list() == []
+        # staged configs are visible while the session is active
+        assert PluginConfig("a").name == "a"
+        plugin_config.config["late"] = "change"
+    assert store.read("a")["config"]["late"] == "change"
+    assert session.flush() == 0
+
+
+def test_failed_session_writes_nothing_since_the_last_flush(make_plugin, store):
+    with pytest.raises(RuntimeError):
+        with ConfigSession() as session:
+            PluginConfig(make_plugin("a")).save_to_vault()
+            session.flush()
+            PluginConfig(make_plugin("b")).save_to_vault()
+            raise RuntimeError("provisioning failed")
+    assert store.list() == ["a"]
@@ -0,0 +1,64 @@
+import threading
+import time
+from freeds_setup.helpers import dc
+from freeds_setup.importing.plugin_config import PluginConfig
+
+COMPOSE = {"services": {"app": {"image": "app:1"}}}
+
+
+def run_pulls(plugin_configs, max_parallel, monkeypatch) -> tuple[int, list]:
+    """Pull with a fake pull, returns the max number of concurrent pulls and the env files they got."""
+    lock = threading.Lock()
+    running = [0, 0]
+    env_files = []
+
+    def pull(work_path, files):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+            env_files.append(files)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    monkeypatch.setattr(dc, "_pull", pull)
+    dc.pull_in_background(plugin_configs, max_parallel=max_parallel)
+    for plugin_config in plugin_configs:
+        dc.wait_for_pull(plugin_config.name)
+    return running[1], env_files
+
+
+def test_max_parallel_applies_per_run(make_plugin, monkeypatch):
+    plugin_configs = [
+        PluginConfig(make_plugin(name, {"config": {"version": "1"}}, compose=COMPOSE)) for name in ("a", "b", "c", "d")
+    ]
+    assert run_pulls(plugin_configs, 1, monkeypatch)[0] == 1
+    assert run_pulls(plugin_configs, 4, monkeypatch)[0] == 4
+
+
+def test_pull_uses_the_env_files_of_up(make_plugin, monkeypatch):
+    plugin_config = PluginConfig(make_plugin("a", {"config": {"version": "1"}}, compose=COMPOSE))
+    _, env_files = run_pulls([plugin_config], 1, monkeypatch)
+    assert env_files == [dc.plugin_env_files(plugin_config)]
+    assert "FDS_A_VERSION='1'" in dc.env_file_path("a").read_text()
+
+
+def test_shell_fds_variables_dont_override_the_plugin_env(make_plugin, monkeypatch):
+    folder = make_plugin("a", {"config": {"host": "vault.example"}}, compose=COMPOSE)
+    (folder / ".env").write_text("TAG=from-dotenv\n")
+    plugin_config = PluginConfig(folder)
+    monkeypatch.setenv("FDS_A_HOST", "shell.example")
+    monkeypatch.setenv("FDS_ROOT_PATH", "/somewhere")
+    monkeypatch.setenv("TAG", "from-shell")
+    monkeypatch.setenv("DOCKER_HOST", "unix:///run/docker.sock")
+
+    env = dc.compose_environment(dc.plugin_env_files(plugin_config))
+    assert "FDS_A_HOST" not in env and "FDS_ROOT_PATH" not in env and "TAG" not in env
+    assert env["DOCKER_HOST"] == "unix:///run/docker.sock"
+
+    calls = []
+    monkeypatch.setattr(dc.subprocess, "run", lambda args, **kwargs: calls.append(kwargs["env"]) or
+                        dc.subprocess.CompletedProcess(args, 0, stdout=""))
+    dc.compose_ps(plugin_config)
+    assert calls[0]["FDS_A_HOST"] == "vault.example"
+    assert "TAG" not in calls[0] and "FDS_ROOT_PATH" not in calls[0]
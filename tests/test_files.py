@@ -0,0 +1,27 @@
+import pytest
+from freeds_setup.helpers.files import atomic_write
+
+
+def test_atomic_write_replaces_content_with_mode(tmp_path):
+    (tmp_path / "out").mkdir()
+    path = tmp_path / "out" / "secret.json"
+    path.write_text("old")
+    atomic_write(path, "new", mode=0o600)
+    assert path.read_text() == "new"
+    assert path.stat().st_mode & 0o777 == 0o600
+    assert list(path.parent.iterdir()) == [path]
+
+
+def test_atomic_write_failure_keeps_old_content(tmp_path, monkeypatch):
+    (tmp_path / "out").mkdir()
+    path = tmp_path / "out" / "data.bin"
+    path.write_bytes(b"old")
+
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr("freeds_setup.helpers.files.os.replace", fail)
+    with pytest.raises(OSError):
+        atomic_write(path, b"new")
+    assert path.read_bytes() == b"old"
+    assert list(path.parent.iterdir()) == [path]
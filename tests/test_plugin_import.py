@@ -0,0 +1,114 @@
+import subprocess
+import pytest
+from freeds_setup.helpers import dc
+from freeds_setup.importing.plugin_config import PluginConfig
+from freeds_setup.importing.plugin_import import import_plugins
+
+COMPOSE = {"services": {"app": {"image": "app"}}}
+
+
+@pytest.fixture
+def started(monkeypatch, store):
+    """Record the plugins started and the stored configs they'd see, nothing is pulled or started for real."""
+    started = []
+    monkeypatch.setattr(dc, "pull_in_background", lambda plugin_configs, max_parallel=3: None)
+    monkeypatch.setattr(dc, "start_plugin", lambda plugin_config: started.append((plugin_config.name, store.list())))
+    return started
+
+
+def fail_start_of(monkeypatch, store, started, failing: str) -> None:
+    def start(plugin_config):
+        if plugin_config.name == failing:
+            raise RuntimeError(f"docker compose up failed for {failing}")
+        started.append((plugin_config.name, store.list()))
+
+    monkeypatch.setattr(dc, "start_plugin", start)
+
+
+@pytest.fixture
+def writes(monkeypatch, store):
+    writes = []
+    write_many = store.write_many
+    monkeypatch.setattr(store, "write_many", lambda configs: (writes.append(sorted(configs)), write_many(configs)))
+    return writes
+
+
+def test_configs_are_written_once_before_the_first_start(make_plugin, started, writes):
+    plugin_configs = [
+        PluginConfig(make_plugin("db", compose=COMPOSE)),
+        PluginConfig(make_plugin("app", {"dependencies": {"db": {}}}, compose=COMPOSE)),
+        PluginConfig(make_plugin("web", {"dependencies": {"app": {}}}, compose=COMPOSE)),
+    ]
+    import_plugins(plugin_configs, start=True)
+    # the configs, then the fingerprints of the started plugins
+    assert writes == [["app", "db", "web"], ["app", "db", "web"]]
+    assert [name for name, _ in started] == ["db", "app", "web"]
+    assert all(stored == ["app", "db", "web"] for _, stored in started)
+
+
+def test_unchanged_plugins_are_skipped(make_plugin, writes):
+    folder = make_plugin("db", {"config": {"host": "localhost"}}, compose=COMPOSE)
+    import_plugins([PluginConfig(folder)], start=False)
+    assert writes == [["db"]]
+
+    import_plugins([PluginConfig(folder)], start=False)
+    assert writes == [["db"]]
+
+    # formatting and comments don't change the fingerprint
+    text = (folder / "plugin.yaml").read_text()
+    (folder / "plugin.yaml").write_text("# a comment\n" + text.replace("  ", "    "))
+    import_plugins([PluginConfig(folder)], start=False)
+    assert writes == [["db"]]
+
+    import_plugins([PluginConfig(folder)], start=False, force=True)
+    assert writes == [["db"], ["db"]]
+
+
+def test_changed_plugins_are_imported(make_plugin, writes):
+    db = make_plugin("db", compose=COMPOSE)
+    app = make_plugin("app", compose=COMPOSE)
+    import_plugins([PluginConfig(db), PluginConfig(app)], start=False)
+
+    make_plugin("app", compose={"services": {"app": {"image": "app:2"}}})
+    import_plugins([PluginConfig(db), PluginConfig(app)], start=False)
+    assert writes == [["app", "db"], ["app"]]
+
+
+def test_plugins_that_didnt_start_are_imported_again(make_plugin, started, store, monkeypatch):
+    a = make_plugin("a", compose=COMPOSE)
+    b = make_plugin("b", compose=COMPOSE)
+    fail_start_of(monkeypatch, store, started, "b")
+    with pytest.raises(RuntimeError):
+        import_plugins([PluginConfig(a), PluginConfig(b)], start=True)
+    assert [name for name, _ in started] == ["a"]
+    assert "fingerprint" in store.read("a")["meta"]
+    assert "fingerprint" not in store.read("b")["meta"]
+
+    started.clear()
+    fail_start_of(monkeypatch, store, started, None)
+    import_plugins([PluginConfig(a), PluginConfig(b)], start=True)
+    assert [name for name, _ in started] == ["b"]
+
+
+def test_failed_provisioning_leaves_nothing_imported(make_plugin, started, store):
+    a = make_plugin("a", compose=COMPOSE)
+    b = make_plugin("b", {"dependencies": {"a": {}}, "resources": {"x": {"type": "NoSuchType"}}}, compose=COMPOSE)
+    with pytest.raises(ValueError):
+        import_plugins([PluginConfig(a), PluginConfig(b)], start=True)
+    assert started == []
+    assert store.list() == []
+
+    make_plugin("b", {"dependencies": {"a": {}}}, compose=COMPOSE)
+    import_plugins([PluginConfig(a), PluginConfig(b)], start=True)
+    assert [name for name, _ in started] == ["a", "b"]
+
+
+def test_failing_compose_up_raises(make_plugin, monkeypatch):
+    plugin_config = PluginConfig(make_plugin("a", compose=COMPOSE))
+
+    def run(args, **kwargs):
+        raise subprocess.CalledProcessError(1, args)
+
+    monkeypatch.setattr(dc.subprocess, "run", run)
+    with pytest.raises(subprocess.CalledProcessError):
+        dc.start_plugin(plugin_config)
@@ -0,0 +1,125 @@
+import threading
+import pytest
+from freeds_setup.importing.port_registry import REGISTRY_ENTRY, PortRegistry
+
+
+def test_write_versioned_is_check_and_set(store):
+    assert store.read_versioned("_entry") == (0, {})
+    assert store.write_versioned("_entry", {"a": 1}, 0)
+    version, data = store.read_versioned("_entry")
+    assert data == {"a": 1}
+    assert not store.write_versioned("_entry", {"a": 2}, 0)
+    assert store.write_versioned("_entry", {"a": 2}, version)
+    assert not store.write_versioned("_entry", {"a": 3}, version)
+    assert store.read_versioned("_entry")[1] == {"a": 2}
+    # internal entries aren't plugins
+    assert store.list() == []
+
+
+def test_allocate_is_idempotent_per_owner(store):
+    registry = PortRegistry(store, first=8000, last=8010)
+    assert registry.allocate("demo.web") == 8000
+    assert registry.allocate("demo.api") == 8001
+    assert registry.allocate("demo.web") == 8000
+    assert registry.allocate("other.web", preferred=8005) == 8005
+    assert registry.allocate("other.api", preferred=8005) == 8002
+    # a new process sees the same allocations
+    assert PortRegistry(store, first=8000, last=8010).allocate("demo.api") == 8001
+
+
+def test_released_ports_are_reused(store):
+    registry = PortRegistry(store, first=8000, last=8010)
+    registry.allocate("a.web")
+    registry.allocate("b.web")
+    registry.allocate("b.api")
+    assert registry.release(owner="a.web") == 8000
+    assert registry.release_plugin("b") == [8001, 8002]
+    assert registry.allocated() == {}
+    assert registry.allocate("c.web") == 8000
+
+
+def test_reserve_moves_an_owner_to_its_new_port(store):
+    registry = PortRegistry(store, first=8000, last=8010)
+    registry.reserve("db.port", 5432)
+    registry.reserve("db.port", 5432)
+    registry.reserve("db.port", 5433)
+    assert registry.allocated() == {5433: "db.port"}
+    registry.reserve("web.port", 8000)
+    assert registry.allocate("web.ui") == 8001
+
+
+def test_known_port_of_two_plugins_is_shared(store):
+    registry = PortRegistry(store, first=8000, last=8010)
+    registry.reserve("pg.port", 5432)
+    registry.reserve("pg17.port", 5432)
+    registry.reserve("web.port", 8000)
+    registry.reserve("other.port", 8000)
+    assert PortRegistry(store, first=8000, last=8010).allocate("other.port") == 8000
+
+    # the port stays taken until its last owner releases it
+    assert registry.release(owner="pg.port") == 5432
+    assert registry.allocated() == {5432: "pg17.port", 8000: "web.port"}
+    registry.release_plugin("web")
+    assert registry.allocate("new.ui") == 8001
+    registry.release(owner="other.port")
+    assert registry.allocate("newer.ui") == 8000
+
+
+def test_duplicate_known_port_doesnt_fail_the_import(make_plugin, store):
+    from freeds_setup.importing.plugin_config import PluginConfig
+    from freeds_setup.importing.plugin_import import import_plugins
+
+    for name in ("pg", "pg17"):
+        folder = make_plugin(name, {"resources": {"port": {"type": "KnownPort", "params": {"number": 5432}}}})
+        import_plugins([PluginConfig(folder)], start=False)
+    registry = PortRegistry(store)
+    assert registry.allocated() == {5432: "pg.port"}
+    assert store.read_versioned(REGISTRY_ENTRY)[1]["shared"] == {"5432": ["pg17.port"]}
+
+
+def test_full_range_fails(store):
+    registry = PortRegistry(store, first=8000, last=8002)
+    registry.allocate("a.web")
+    registry.allocate("b.web")
+    with pytest.raises(RuntimeError):
+        registry.allocate("c.web")
+
+
+def test_stale_registry_retries_on_conflict(store):
+    first = PortRegistry(store, first=8000, last=8010)
+    second = PortRegistry(store, first=8000, last=8010)
+    assert first.allocate("a.web") == 8000
+    # second loaded its state before first wrote, its write is refused and it retries on fresh state
+    second._refresh()
+    assert first.allocate("b.web") == 8001
+    assert second.allocate("c.web") == 8002
+    assert store.read_versioned(REGISTRY_ENTRY)[1]["allocated"] == {"8000": "a.web", "8001": "b.web", "8002": "c.web"}
+
+
+def test_concurrent_registries_never_share_a_port(store):
+    registries = [PortRegistry(store, first=8000, last=8100, retries=50) for _ in range(4)]
+    ports = []
+    lock = threading.Lock()
+
+    def allocate(registry, n):
+        for i in range(10):
+            port = registry.allocate(f"p{n}.ui{i}")
+            with lock:
+                ports.append(port)
+
+    threads = [threading.Thread(target=allocate, args=(r, n)) for n, r in enumerate(registries)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(ports) == len(set(ports)) == 40
+    assert len(PortRegistry(store, first=8000, last=8100).allocated()) == 40
+
+
+def test_seeded_from_stored_plugins(store):
+    store.write("demo", {"resources": {"web": {"type": "Ui", "params": {"number": 8003}}, "admin": {"type": "AdminAccount"}}})
+    store.write("other", {"resources": {"port": {"type": "KnownPort", "params": {"number": 8003}}}})
+    registry = PortRegistry(store, first=8000, last=8010)
+    assert registry.allocate("demo.web") == 8003
+    assert registry.allocate("other.port") == 8003
+    assert registry.allocate("other.web", preferred=8003) == 8000
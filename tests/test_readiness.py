@@ -0,0 +1,19 @@
+import pytest
+from freeds_setup.helpers import readiness
+
+
+class Response:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+
+def test_wait_for_vault_waits_for_an_unsealed_vault(monkeypatch):
+    codes = iter([501, 503, 472, 200])
+    monkeypatch.setattr(readiness.requests, "get", lambda url, timeout: Response(next(codes)))
+    readiness.wait_for_vault(deadline=5)
+    assert next(codes, None) is None
+
+
+def test_wait_until_times_out():
+    with pytest.raises(TimeoutError):
+        readiness.wait_until(lambda: False, "never", deadline=0.1)
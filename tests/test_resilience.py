@@ -0,0 +1,76 @@
+import time
+import pytest
+import requests
+from freeds_setup.helpers.bao_client import BaoClient
+from freeds_setup.helpers.resilience import AdaptiveLimiter, CircuitBreaker, CircuitOpenError
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        breaker.failure()
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    breaker.failure()
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    breaker.failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_half_open_trial_closes_or_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    open_breaker(breaker)
+    time.sleep(0.02)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # only one trial at a time
+    assert not breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open"
+
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_unreported_trial_doesnt_block_forever():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    open_breaker(breaker)
+    time.sleep(0.02)
+    assert breaker.allow()
+    assert not breaker.allow()
+    time.sleep(0.02)
+    assert breaker.allow()
+
+
+def test_unexpected_error_in_trial_reopens_the_circuit(monkeypatch):
+    bao = BaoClient()
+    bao.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    open_breaker(bao.breaker)
+    time.sleep(0.02)
+
+    def broken(*args, **kwargs):
+        raise requests.exceptions.ChunkedEncodingError("connection broken")
+
+    monkeypatch.setattr(bao.session, "request", broken)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        bao._request("GET", "http://127.0.0.1:8200/v1/sys/health")
+    assert bao.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        bao._request("GET", "http://127.0.0.1:8200/v1/sys/health")
+
+
+def test_limiter_halves_on_overload_and_grows_back():
+    limiter = AdaptiveLimiter(initial=8, max_limit=16)
+    limiter.record(0.01, overloaded=True)
+    assert limiter.limit == 4
+    for _ in range(4):
+        limiter.record(0.01)
+    assert limiter.limit == pytest.approx(5, abs=0.1)
@@ -0,0 +1,77 @@
+from freeds_setup.importing.plugin_config import PluginConfig
+from freeds_setup.importing.plugin_import import provision_all
+from freeds_setup.importing.port_registry import get_port_registry
+from freeds_setup.importing.resource_plan import CREATE, DELETE, NOOP, UPDATE, plan_resources
+
+UI = {"type": "Ui", "params": {"uri": "http://${FDS_DEMO_HOST}:${FDS_DEMO_UI_PORT}"}}
+ADMIN = {"type": "AdminAccount"}
+PORT = {"type": "KnownPort", "params": {"number": 5432}}
+
+
+def import_plugin(folder, store) -> PluginConfig:
+    """Provision against the stored config and store the result, like an import without start."""
+    plugin_config = PluginConfig(folder)
+    provision_all(plugin_config, stored=store.read(plugin_config.name))
+    plugin_config.save_to_vault()
+    return plugin_config
+
+
+def test_unchanged_resources_keep_their_outputs(make_plugin, store):
+    folder = make_plugin("demo", {"config": {"host": "localhost"}, "resources": {"admin": ADMIN, "web": UI}})
+    first = import_plugin(folder, store)
+
+    again = PluginConfig(folder)
+    actions = plan_resources(again, store.read("demo"))
+    assert [a.action for a in actions] == [NOOP, NOOP, NOOP]
+
+    second = import_plugin(folder, store)
+    assert second.config["admin_password"] == first.config["admin_password"]
+    assert second.config["ui_uri"] == first.config["ui_uri"]
+    assert second.ports == first.ports
+
+
+def test_plugin_config_change_reruns_ui(make_plugin, store):
+    folder = make_plugin("demo", {"config": {"host": "old.example"}, "resources": {"admin": ADMIN, "web": UI}})
+    first = import_plugin(folder, store)
+    port = first.config["ui_port"]
+    assert first.config["ui_uri"] == f"http://old.example:{port}"
+
+    make_plugin("demo", {"config": {"host": "new.example"}, "resources": {"admin": ADMIN, "web": UI}})
+    actions = {a.resource: a.action for a in plan_resources(PluginConfig(folder), store.read("demo"))}
+    assert actions == {None: UPDATE, "admin": NOOP, "web": UPDATE}
+
+    second = import_plugin(folder, store)
+    assert second.config["ui_uri"] == f"http://new.example:{port}"
+    assert second.config["admin_password"] == first.config["admin_password"]
+
+
+def test_changed_params_update_only_that_resource(make_plugin, store):
+    folder = make_plugin("demo", {"resources": {"admin": ADMIN, "port": PORT}})
+    import_plugin(folder, store)
+
+    make_plugin("demo", {"resources": {"admin": ADMIN, "port": {"type": "KnownPort", "params": {"number": 5433}}}})
+    actions = {a.resource: a.action for a in plan_resources(PluginConfig(folder), store.read("demo"))}
+    assert actions == {None: UPDATE, "admin": NOOP, "port": UPDATE}
+
+    import_plugin(folder, store)
+    assert get_port_registry().allocated() == {5433: "demo.port"}
+
+
+def test_removed_resource_is_deleted_and_released(make_plugin, store):
+    folder = make_plugin("demo", {"resources": {"admin": ADMIN, "port": PORT}})
+    import_plugin(folder, store)
+    assert get_port_registry().allocated() == {5432: "demo.port"}
+
+    make_plugin("demo", {"resources": {"admin": ADMIN}})
+    actions = plan_resources(PluginConfig(folder), store.read("demo"))
+    assert [(a.resource, a.action) for a in actions if a.action == DELETE] == [("port", DELETE)]
+
+    import_plugin(folder, store)
+    assert "port" not in store.read("demo")["meta"]["ledger"]
+    assert get_port_registry().allocated() == {}
+
+
+def test_new_plugin_creates_everything(make_plugin, store):
+    folder = make_plugin("demo", {"resources": {"admin": ADMIN, "web": UI}})
+    actions = plan_resources(PluginConfig(folder), {})
+    assert [a.action for a in actions] == [CREATE, CREATE, CREATE]
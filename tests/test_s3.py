@@ -0,0 +1,34 @@
+import pytest
+from freeds_plugin import s3
+
+
+@pytest.fixture(autouse=True)
+def shared(store, monkeypatch):
+    monkeypatch.delenv("FDS_SHARED_S3_URL", raising=False)
+    monkeypatch.delenv("FDS_CURRENT_PLUGIN_NAME", raising=False)
+    store.write("shared", {"config": {"plugin_name": "shared", "s3_url": "http://127.0.0.1:9000"}})
+    s3.reset_s3_clients()
+    yield
+    s3.reset_s3_clients()
+
+
+def test_explicit_credentials_need_no_current_plugin():
+    client = s3.get_s3_client("user", "password")
+    assert client.meta.endpoint_url == "http://127.0.0.1:9000"
+    assert s3.get_s3_client("user", "password") is client
+    assert s3.get_s3_client("other", "password") is not client
+
+
+def test_plugin_credentials_are_read_once(store, monkeypatch):
+    monkeypatch.setenv("FDS_CURRENT_PLUGIN_NAME", "demo")
+    store.write("demo", {"config": {"plugin_name": "demo", "s3_user": "demo", "s3_password": "secret"}})
+    client = s3.get_s3_client()
+    store.delete("demo")
+    assert s3.get_s3_client() is client
+    with pytest.raises(ValueError):
+        s3.get_s3_client(refresh=True)
+
+
+def test_user_without_password_is_rejected():
+    with pytest.raises(ValueError):
+        s3.get_s3_client("user")
@@ -0,0 +1,56 @@
+import threading
+import time
+import pytest
+from freeds_setup.importing.plugin_config import PluginConfig
+from freeds_setup.importing.scheduler import run_in_dependency_order
+
+
+def plugin(name: str, *dependencies: str) -> PluginConfig:
+    return PluginConfig.from_data(
+        {"config": {"plugin_name": name}, "dependencies": {d: {} for d in dependencies}}
+    )
+
+
+def test_plugins_run_after_their_dependencies():
+    plugins = [plugin("web", "app"), plugin("app", "db"), plugin("db"), plugin("docs"), plugin("vault")]
+    lock = threading.Lock()
+    finished = []
+
+    def action(plugin_config):
+        time.sleep(0.01)
+        with lock:
+            finished.append(plugin_config.name)
+
+    run_in_dependency_order(plugins, action, max_workers=4)
+    assert finished[0] == "vault"
+    assert finished.index("db") < finished.index("app") < finished.index("web")
+    assert sorted(finished) == ["app", "db", "docs", "vault", "web"]
+
+
+def test_a_plugin_starts_as_soon_as_its_own_dependencies_are_done():
+    # app only waits for db, not for the slow plugin in the same "wave"
+    plugins = [plugin("slow"), plugin("db"), plugin("app", "db")]
+    lock = threading.Lock()
+    finished = []
+
+    def action(plugin_config):
+        time.sleep(0.2 if plugin_config.name == "slow" else 0.01)
+        with lock:
+            finished.append(plugin_config.name)
+
+    run_in_dependency_order(plugins, action, max_workers=4)
+    assert finished == ["db", "app", "slow"]
+
+
+def test_failure_stops_dependents_and_raises():
+    plugins = [plugin("db"), plugin("app", "db"), plugin("docs")]
+    done = []
+
+    def action(plugin_config):
+        if plugin_config.name == "db":
+            raise RuntimeError("db failed")
+        done.append(plugin_config.name)
+
+    with pytest.raises(RuntimeError, match="db failed"):
+        run_in_dependency_order(plugins, action, max_workers=1)
+    assert "app" not in done
@@ -0,0 +1,64 @@
+import threading
+import time
+import pytest
+from freeds_setup.helpers import stack
+from freeds_setup.importing.plugin_config import PluginConfig
+
+
+def plugin(name: str, *dependencies: str) -> PluginConfig:
+    return PluginConfig.from_data(
+        {"config": {"plugin_name": name}, "dependencies": {d: {} for d in dependencies}}
+    )
+
+
+def names(waves) -> list[list[str]]:
+    return [[p.name for p in wave] for wave in waves]
+
+
+def test_dependency_waves():
+    plugins = [
+        plugin("web", "app", "cache"),
+        plugin("app", "db", "postgres"),
+        plugin("cache"),
+        plugin("db"),
+        plugin("vault"),
+    ]
+    # postgres isn't in the list, that dependency is ignored
+    assert names(stack.dependency_waves(plugins)) == [["vault"], ["cache", "db"], ["app"], ["web"]]
+
+
+def test_dependency_cycle_is_an_error():
+    with pytest.raises(ValueError):
+        stack.dependency_waves([plugin("a", "b"), plugin("b", "a")])
+
+
+def test_waves_run_in_parallel_and_in_order():
+    waves = stack.dependency_waves([plugin("a"), plugin("b"), plugin("c", "a", "b")])
+    lock = threading.Lock()
+    events = []
+
+    def action(plugin_config):
+        with lock:
+            events.append(("start", plugin_config.name))
+        time.sleep(0.05)
+        with lock:
+            events.append(("end", plugin_config.name))
+
+    stack._run_waves(waves, action, "test", max_parallel=4)
+    # a and b overlap, c starts after both ended
+    assert events[:2] == [("start", "a"), ("start", "b")]
+    assert events[-2:] == [("start", "c"), ("end", "c")]
+
+
+def test_failed_wave_stops_the_next():
+    waves = stack.dependency_waves([plugin("a"), plugin("b"), plugin("c", "a")])
+    done = []
+
+    def action(plugin_config):
+        if plugin_config.name == "a":
+            raise RuntimeError("a failed")
+        done.append(plugin_config.name)
+
+    with pytest.raises(RuntimeError, match="a failed"):
+        stack._run_waves(waves, action, "test", max_parallel=4)
+    assert done == ["b"]
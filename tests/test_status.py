@@ -0,0 +1,38 @@
+import time
+import subprocess
+from freeds_setup.helpers import dc, status
+from freeds_setup.importing.plugin_config import PluginConfig
+
+
+def test_config_only_plugin_is_ok(make_plugin, monkeypatch):
+    PluginConfig(make_plugin("settings", {"config": {"host": "localhost"}})).save_to_vault()
+    monkeypatch.setattr(status, "probe_vault", lambda budget: (True, "active"))
+
+    result = status.collect_status(timeout=1)
+    assert result["plugins"]["settings"] == {"ok": True, "containers": None, "ports": {}, "ui": {}}
+    assert result["ok"]
+
+
+def test_compose_ps_writes_no_env_file(make_plugin, monkeypatch):
+    plugin_config = PluginConfig(make_plugin("web", compose={"services": {"web": {"image": "nginx"}}}))
+    calls = []
+
+    def run(args, **kwargs):
+        calls.append(kwargs["env"])
+        return subprocess.CompletedProcess(args, 0, stdout='{"Service": "web", "State": "running"}\n')
+
+    monkeypatch.setattr(dc.subprocess, "run", run)
+    assert dc.compose_ps(plugin_config) == [{"Service": "web", "State": "running"}]
+    assert calls[0]["FDS_WEB_PLUGIN_NAME"] == "web"
+    assert not dc.env_file_path("web").exists()
+
+
+def test_config_load_is_inside_the_budget(monkeypatch):
+    monkeypatch.setattr(status, "probe_vault", lambda budget: (True, "active"))
+    monkeypatch.setattr(status, "get_all_plugins", lambda: time.sleep(5))
+
+    started = time.monotonic()
+    result = status.collect_status(timeout=0.3)
+    assert time.monotonic() - started < 1.0
+    assert not result["ok"]
+    assert result["error"] == "Plugin configs could not be loaded: timeout"
@@ -0,0 +1,23 @@
+import os
+from freeds_setup.helpers.yaml_cache import YamlCache
+
+
+def test_disk_cache_is_capped_to_the_recently_used_files(tmp_path):
+    cache_dir = tmp_path / "cache"
+    sources = []
+    for i in range(4):
+        source = tmp_path / f"plugin{i}.yaml"
+        source.write_text(f"name: plugin{i}\n")
+        sources.append(source)
+
+    cache = YamlCache(cache_dir, max_files=2)
+    for i, source in enumerate(sources):
+        assert cache.load(source) == {"name": f"plugin{i}"}
+        os.utime(cache._file(str(source.resolve())), ns=(i * 10**9, i * 10**9))
+    assert len(list(cache_dir.glob("*.pickle"))) == 4
+
+    # reading plugin0 from disk makes it the most recently used
+    YamlCache(cache_dir, max_files=10).load(sources[0])
+    cache = YamlCache(cache_dir, max_files=2)
+    kept = {p.name for p in cache_dir.glob("*.pickle")}
+    assert kept == {cache._file(str(sources[i].resolve())).name for i in (0, 3)}